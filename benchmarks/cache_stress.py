@@ -0,0 +1,77 @@
+"""
+stress test of concurrent writes into one directory cache
+
+Every process creates and deletes its own files and updates the cache after each change.
+Finally the cache file must contain exactly the files left on disk.
+
+usage: python benchmarks/cache_stress.py [processes] [files_per_process] [json|sqlite]
+"""
+from __future__ import print_function
+
+from multiprocessing import Process
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connector.backends import get_backend
+from connector.models import CacheDir, Config
+
+
+def _config(directory, backend):
+    config = Config(directory)
+    config.thumb_workers = 0
+    config.cache_backend = backend
+    return config
+
+
+def writer(directory, backend, number, count):
+    """ create files, every third created file is deleted again
+    :param directory: full path to shared directory
+    :param backend: name of cache backend
+    :param number: number of process
+    :param count: number of created files
+    """
+    config = _config(directory, backend)
+    for i in range(count):
+        name = 'w%03d-%05d.txt' % (number, i)
+        with open(directory + name, 'w') as new_file:
+            new_file.write(name)
+        CacheDir(directory, config).update_item(name)
+        if i % 3 == 2:
+            os.unlink(directory + name)
+            CacheDir(directory, config).delete_item(name)
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    backend = sys.argv[3] if len(sys.argv) > 3 else 'json'
+    directory = tempfile.mkdtemp() + '/'
+    try:
+        config = _config(directory, backend)
+        CacheDir(directory, config)
+        workers = [Process(target=writer, args=(directory, backend, i, count)) for i in range(processes)]
+        start = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.time() - start
+
+        cached = set(get_backend(config).load(directory))
+        on_disk = set(name for name in os.listdir(directory) if not name.startswith('.'))
+        operations = processes * (count + count // 3)
+        print('backend: %s, processes: %d, cache updates: %d, %.1f updates/s'
+              % (backend, processes, operations, operations / elapsed))
+        print('lost updates: %d, stale entries: %d' % (len(on_disk - cached), len(cached - on_disk)))
+        return 0 if cached == on_disk else 1
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
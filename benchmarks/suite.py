@@ -0,0 +1,341 @@
+"""
+benchmark suite of Connector actions on synthetic roots
+
+Generates roots in temporary directory:
+ wide - one folder with many files
+ deep - nested folders with few files in each
+ images - folder with many small images
+and measures reads and changes of files by actions of Connector called directly and through views.index with
+Django test client.
+Results are written as JSON, i.e. for comparison of releases.
+
+usage: python benchmarks/suite.py [--scale N] [--repeat N] [--output results.json] [--backend json|sqlite]
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'gstbrowser.settings')
+
+from PIL import Image
+
+from connector.listings import ListingCache
+from connector.models import CacheDir, Config, Connector
+from connector.thumbnails import ThumbnailStore
+from connector.tree import TreeIndex
+from connector.utils import state_dir
+
+
+def make_wide(directory, files):
+    """ one folder with many text files
+    :param directory: full path to root
+    :param files: number of files
+    """
+    os.makedirs(directory + 'wide')
+    for i in range(files):
+        with open(directory + 'wide/file%06d.txt' % i, 'w') as new_file:
+            new_file.write('x' * (i % 1024))
+
+
+def make_deep(directory, depth, width, files):
+    """ tree of nested folders
+    :param directory: full path to root
+    :param depth: number of levels
+    :param width: number of subfolders of each folder
+    :param files: number of files in each folder
+    """
+    def make(path, level):
+        os.makedirs(directory + path)
+        for i in range(files):
+            with open(directory + path + 'f%d.txt' % i, 'w') as new_file:
+                new_file.write(path)
+        if level < depth:
+            for i in range(width):
+                make(path + 'd%d/' % i, level + 1)
+    make('deep/', 1)
+
+
+def make_images(directory, images):
+    """ folder with jpeg images
+    :param directory: full path to root
+    :param images: number of images
+    """
+    os.makedirs(directory + 'images')
+    for i in range(images):
+        im = Image.new('RGB', (640, 480), (i % 256, (i * 7) % 256, (i * 13) % 256))
+        im.save(directory + 'images/img%05d.jpg' % i, quality=85)
+
+
+class Suite(object):
+    """ measured cases, each case is called repeat times and best and median times are reported """
+
+    def __init__(self, root, backend, repeat):
+        self._root = root
+        self._backend = backend
+        self._repeat = repeat
+        self.results = []
+
+    def config(self):
+        """ returns config of synthetic root """
+        config = Config(self._root)
+        config.thumb_workers = 0
+        config.cache_backend = self._backend
+        return config
+
+    def measure(self, name, function, setup=None, **info):
+        """ measure function, setup is called before each call and is not measured """
+        times = []
+        for _ in range(self._repeat):
+            if setup is not None:
+                setup()
+            start = time.time()
+            function()
+            times.append(time.time() - start)
+        times.sort()
+        result = dict(info, name=name, best=times[0], median=times[len(times) // 2], repeat=self._repeat)
+        self.results.append(result)
+        print('%-40s best %9.4f s  median %9.4f s' % (name, result['best'], result['median']))
+
+    def drop_caches(self, path, thumbnails=False):
+        """ delete caches of folder and its subfolders on disk and in memory """
+        config = self.config()
+        if thumbnails:
+            shutil.rmtree(state_dir(self._root) + ThumbnailStore.STORE_DIRNAME, ignore_errors=True)
+        for dirpath, dirnames, _ in os.walk(self._root + path):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            CacheDir.remove(dirpath, config)
+        ListingCache.shared().clear()
+
+    def drop_memory(self):
+        """ clear in-process caches, caches on disk are kept """
+        ListingCache.shared().clear()
+
+    def drop_tree(self):
+        """ delete index of folders """
+        tree = state_dir(self._root) + TreeIndex.INDEX_FILENAME
+        if os.path.exists(tree):
+            os.unlink(tree)
+
+    def run_direct(self, sizes):
+        """ measure methods of Connector """
+        connector = Connector(self.config())
+        self.measure('direct tree cold', lambda: Connector(self.config()).get_folders_tree(),
+                     self.drop_tree, folders=sizes['folders'])
+        self.measure('direct tree warm', lambda: Connector(self.config()).get_folders_tree(),
+                     folders=sizes['folders'])
+        self.measure('direct tree lazy depth 1', lambda: Connector(self.config()).get_folders_tree('deep/', 1),
+                     folders=sizes['folders'])
+        for path, files in (('wide/', sizes['wide']), ('images/', sizes['images'])):
+            label = path.rstrip('/')
+            self.measure('direct files %s cold' % label, lambda: connector.get_files(path),
+                         lambda: self.drop_caches(path), files=files)
+            self.measure('direct files %s disk cache' % label, lambda: connector.get_files(path),
+                         self.drop_memory, files=files)
+            self.measure('direct files %s warm' % label, lambda: connector.get_files(path), files=files)
+            self.measure('direct files %s page' % label, lambda: connector.get_files(path, 0, 50, 'date'),
+                         files=files)
+        self.measure('direct refresh images with thumbnails', lambda: CacheDir(self._root + 'images/', self.config()),
+                     lambda: self.drop_caches('images/', True), files=sizes['images'])
+        self.measure('direct refresh images unchanged',
+                     lambda: CacheDir(self._root + 'images/', self.config()).refresh(), files=sizes['images'])
+        self.measure('direct search', lambda: connector.search('file0001'), folders=sizes['folders'])
+        self.run_actions('direct', _DirectActions(connector), sizes)
+
+    def run_actions(self, prefix, actions, sizes):
+        """ measure actions changing files, setup restores state before each call by actions which are not measured,
+        folder which is not empty cannot be deleted so each copy of folder gets new name in folder copies
+        :param prefix: prefix of names of cases
+        :param actions: instance of _DirectActions or _ClientActions
+        """
+        exists = lambda path: os.path.exists(self._root + path)
+        copies = itertools.count()
+        if not exists('copies'):
+            actions.mkdir('', 'copies')
+
+        def unless(path, function, *args):
+            return lambda: None if not exists(path) else function(*args)
+
+        wide, folders = dict(files=sizes['wide']), dict(folders=sizes['folders'])
+        self.measure(prefix + ' upload 1 MB into wide', lambda: actions.upload('wide/', 'upload.bin', 1048576),
+                     unless('wide/upload.bin', actions.delete, 'wide/', 'upload.bin'), **wide)
+        self.measure(prefix + ' mkdir in wide', lambda: actions.mkdir('wide/', 'newdir'),
+                     unless('wide/newdir', actions.delete, 'wide/', 'newdir'), **wide)
+        self.measure(prefix + ' rename file in wide', lambda: actions.rename('wide/', 'file000001.txt', 'renamed.txt'),
+                     unless('wide/renamed.txt', actions.rename, 'wide/', 'renamed.txt', 'file000001.txt'), **wide)
+        self.measure(prefix + ' rename folder', lambda: actions.rename('deep/', 'd0', 'r0'),
+                     unless('deep/r0', actions.rename, 'deep/', 'r0', 'd0'), **folders)
+        self.measure(prefix + ' delete file in wide', lambda: actions.delete('wide/', 'delete.bin'),
+                     lambda: actions.upload('wide/', 'delete.bin', 1024), **wide)
+        self.measure(prefix + ' delete empty folder', lambda: actions.delete('deep/', 'empty'),
+                     lambda: actions.mkdir('deep/', 'empty'), **folders)
+        self.measure(prefix + ' copy file from wide', lambda: actions.copy('wide/', 'file000002.txt', 'deep/'),
+                     unless('deep/file000002.txt', actions.delete, 'deep/', 'file000002.txt'), **wide)
+        self.measure(prefix + ' copy folder',
+                     lambda: actions.copy('deep/', 'd2', 'copies/%s%d' % (prefix, next(copies))), **folders)
+        self.measure(prefix + ' move file from wide', lambda: actions.move('wide/', 'file000003.txt', 'deep/'),
+                     unless('deep/file000003.txt', actions.move, 'deep/', 'file000003.txt', 'wide/'), **wide)
+        self.measure(prefix + ' move folder into wide', lambda: actions.move('deep/', 'd1', 'wide/'),
+                     unless('wide/d1', actions.move, 'wide/', 'd1', 'deep/'), **folders)
+
+    def run_client(self, sizes):
+        """ measure requests through urls and views.index """
+        from django.conf import settings
+        settings.GSTBROWSER_ROOT_DIR['benchmark'] = self._root
+        settings.GSTBROWSER_THUMB_WORKERS = dict(settings.GSTBROWSER_THUMB_WORKERS, benchmark=0)
+        settings.GSTBROWSER_CACHE_BACKEND = dict(settings.GSTBROWSER_CACHE_BACKEND, benchmark=self._backend)
+        settings.ALLOWED_HOSTS = ['*']
+        import django
+        django.setup()
+        from django.test import Client
+
+        client = Client()
+
+        def get(**params):
+            params['config'] = 'benchmark'
+            return _content(client.get('/', params))
+
+        self.measure('client tree', lambda: get(action='tree'), folders=sizes['folders'])
+        for path, files in (('wide/', sizes['wide']), ('images/', sizes['images'])):
+            label = path.rstrip('/')
+            self.measure('client files %s cold' % label, lambda: get(action='files', path=path),
+                         lambda: self.drop_caches(path), files=files)
+            self.measure('client files %s warm' % label, lambda: get(action='files', path=path), files=files)
+        self.measure('client search', lambda: get(action='search', q='file0001'), folders=sizes['folders'])
+        self.run_actions('client', _ClientActions(client, 'benchmark'), sizes)
+
+
+def _content(response):
+    """ returns body of response of Django test client """
+    if response.streaming:
+        return ''.join(response.streaming_content)
+    return response.content
+
+
+def _checked(action, result):
+    """ returns result of action, failed action stops benchmark instead of measuring error response """
+    if result.get('status') != 'OK':
+        raise RuntimeError('%s failed: %r' % (action, result))
+    return result
+
+
+class _Upload(object):
+    """ uploaded file for Connector.upload """
+
+    def __init__(self, name, size):
+        self.name = name
+        self._data = 'u' * size
+
+    def chunks(self):
+        for start in range(0, len(self._data), 65536):
+            yield self._data[start:start + 65536]
+
+
+class _DirectActions(object):
+    """ actions changing files called as methods of Connector """
+
+    def __init__(self, connector):
+        self._connector = connector
+
+    def upload(self, path, name, size):
+        return _checked('upload', self._connector.upload(path, _Upload(name, size)))
+
+    def mkdir(self, path, name):
+        return _checked('mkdir', self._connector.mk_dir(path, name))
+
+    def rename(self, path, old, new):
+        return _checked('rename', self._connector.rename(path, old, new))
+
+    def delete(self, path, name):
+        return _checked('delete', self._connector.delete(path, name))
+
+    def copy(self, path, name, target):
+        return _checked('copy', self._connector.copy(path, name, target))
+
+    def move(self, path, name, target):
+        return _checked('move', self._connector.move(path, name, target))
+
+
+class _ClientActions(object):
+    """ actions changing files posted to views.index by Django test client """
+
+    def __init__(self, client, config):
+        self._client = client
+        self._config = config
+
+    def _post(self, action, **params):
+        params.update(config=self._config, action=action)
+        return _checked(action, json.loads(_content(self._client.post('/', params))))
+
+    def upload(self, path, name, size):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self._post('upload', path=path, file=SimpleUploadedFile(name, 'u' * size))
+
+    def mkdir(self, path, name):
+        return self._post('mkdir', path=path, dir=name)
+
+    def rename(self, path, old, new):
+        return self._post('rename', path=path, old=old, new=new)
+
+    def delete(self, path, name):
+        return self._post('delete', path=path, name=name)
+
+    def copy(self, path, name, target):
+        return self._post('copy', path=path, old=name, new=target)
+
+    def move(self, path, name, target):
+        return self._post('move', path=path, old=name, new=target)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of Connector actions')
+    parser.add_argument('--scale', type=int, default=1, help='multiplier of size of synthetic roots')
+    parser.add_argument('--repeat', type=int, default=5, help='number of calls of each case')
+    parser.add_argument('--backend', default='json', choices=('json', 'sqlite'))
+    parser.add_argument('--output', default='benchmark-results.json', help='file with JSON results')
+    parser.add_argument('--skip-client', action='store_true', help='do not measure requests through views')
+    args = parser.parse_args()
+
+    sizes = {'wide': 5000 * args.scale, 'images': 200 * args.scale, 'deep': (5, 3, 5)}
+    sizes['folders'] = sum(3 ** level for level in range(sizes['deep'][0])) + 2
+    root = tempfile.mkdtemp() + '/'
+    try:
+        start = time.time()
+        make_wide(root, sizes['wide'])
+        make_deep(root, *sizes['deep'])
+        make_images(root, sizes['images'])
+        print('fixtures: %(wide)d files, %(images)d images, %(folders)d folders' % sizes,
+              'in %.1f s' % (time.time() - start))
+
+        suite = Suite(root, args.backend, args.repeat)
+        suite.run_direct(sizes)
+        if not args.skip_client:
+            suite.run_client(sizes)
+    finally:
+        shutil.rmtree(root)
+
+    with open(args.output, 'w') as output:
+        json.dump({
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'backend': args.backend,
+            'scale': args.scale,
+            'repeat': args.repeat,
+            'sizes': sizes,
+            'results': suite.results
+        }, output, indent=2, sort_keys=True)
+    print('results written to ' + args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,104 @@
+"""
+benchmark of copy and move of folder tree
+
+Compares recursive copy and move of one folder by Connector with the previous way, when client had to
+create folders and copy or move files one by one and each file updated cache of its folder.
+
+usage: python benchmarks/tree_copy.py [files] [files_per_folder] [json|sqlite]
+"""
+from __future__ import print_function
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from connector.models import CacheDir, Config, Connector
+
+
+def _config(directory, backend):
+    config = Config(directory)
+    config.thumb_workers = 0
+    config.cache_backend = backend
+    return config
+
+
+def make_tree(directory, files, per_folder):
+    """ create folder with files spread in nested folders, returns list of relative paths of folders
+    :param directory: full path to new folder
+    :param files: number of files
+    :param per_folder: number of files in one folder
+    """
+    folders = []
+    for i in range(files):
+        if i % per_folder == 0:
+            folder = 'd%03d/e%03d/' % (len(folders) // 10, len(folders) % 10)
+            os.makedirs(directory + folder)
+            folders.append(folder)
+        with open(directory + folder + 'f%05d.txt' % i, 'w') as new_file:
+            new_file.write('x' * (i % 4096))
+    return folders
+
+
+def per_file(config, connector, source, target, is_move):
+    """ previous way: one request per folder and per file """
+    for dirpath, dirnames, filenames in os.walk(config.base_dir + source):
+        dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+        relative = os.path.relpath(dirpath, config.base_dir + source)
+        relative = '' if relative == '.' else relative + '/'
+        parent = config.base_dir + target + relative
+        for name in dirnames:
+            connector.mk_dir(target + relative, name)
+        for name in filenames:
+            if name.startswith('.'):
+                continue
+            if is_move:
+                shutil.move(dirpath + '/' + name, parent + name)
+                CacheDir(dirpath, config).delete_item(name)
+            else:
+                shutil.copy(dirpath + '/' + name, parent + name)
+            CacheDir(parent, config).update_item(name)
+    if is_move:
+        shutil.rmtree(config.base_dir + source)
+
+
+def measure(label, function, *args):
+    """ print time of call of function """
+    start = time.time()
+    function(*args)
+    elapsed = time.time() - start
+    print('%-28s %8.3f s' % (label, elapsed))
+    return elapsed
+
+
+def main():
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    per_folder = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    backend = sys.argv[3] if len(sys.argv) > 3 else 'json'
+    directory = tempfile.mkdtemp() + '/'
+    try:
+        config = _config(directory, backend)
+        make_tree(directory + 'src/', files, per_folder)
+        connector = Connector(config)
+        # caches of source folders exist as in browsed tree
+        for dirpath, _, _ in os.walk(directory + 'src'):
+            CacheDir(dirpath, config)
+        connector.get_folders_tree()
+        for path, name in (('', 'old'), ('', 'new'), ('', 'moved-old'), ('old/', 'src')):
+            connector.mk_dir(path, name)
+
+        print('backend: %s, files: %d, files per folder: %d' % (backend, files, per_folder))
+        measure('copy per file', per_file, config, connector, 'src/', 'old/src/', False)
+        measure('copy folder', connector.copy, '', 'src', 'new')
+        measure('move per file', per_file, config, connector, 'old/src/', 'moved-old/', True)
+        measure('move folder', connector.move, 'new/', 'src', 'moved-new')
+        return 0
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+"""
+backends JsonFileBackend, SqliteBackend
+
+Storage of cached content of directories used by CacheDir. Items of directory are dictionaries
+name of file -> Record, records are stored as lists returned by Record.pack.
+
+"""
+import errno
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from connector.listings import ListingCache
+from connector.records import Record
+from connector.search import NameIndex
+from connector.utils import atomic_write, state_dir
+
+
+def get_backend(config):
+    """ returns backend selected by config.cache_backend
+    :param config: instance of Config
+    """
+    if config.cache_backend == 'sqlite':
+        return SqliteBackend.get(config)
+    return JsonFileBackend(config)
+
+
+class CacheBackend(object):
+    """ interface of storage of cached content of directories """
+
+    def lock_filename(self, directory):
+        """ returns full path to file used for locking of directory between processes
+        :param directory: full path to directory with trailing slash
+        """
+        raise NotImplementedError
+
+    def version(self, directory):
+        """ returns tuple (token, saved) where token changes with each save of directory and saved is time
+        of last save, None if directory is not cached
+        :param directory: full path to directory with trailing slash
+        """
+        raise NotImplementedError
+
+    def load(self, directory):
+        """ returns cached items of directory, None if directory is not cached
+        :param directory: full path to directory with trailing slash
+        """
+        raise NotImplementedError
+
+    def save(self, directory, items, changed=None, deleted=None):
+        """ save items of directory, backend may write only changed items if they are known
+        :param directory: full path to directory with trailing slash
+        :param items: all items of directory
+        :param changed: list of names of added or updated items, None if all items may change
+        :param deleted: list of names of deleted items
+        """
+        raise NotImplementedError
+
+    def remove(self, directory):
+        """ delete cache of directory
+        :param directory: full path to directory with trailing slash
+        """
+        raise NotImplementedError
+
+    def move(self, directory, new_directory):
+        """ keep caches of moved directory and its subdirectories
+        :param directory: full path to original directory with trailing slash
+        :param new_directory: full path to new directory with trailing slash
+        """
+        raise NotImplementedError
+
+    def search(self, directories, query):
+        """ returns list of tuples (relative path of directory, name) of cached items matching query,
+        sorted by path and name
+        :param directories: dictionary relative path -> full path of searched directories
+        :param query: instance of NameQuery
+        """
+        raise NotImplementedError
+
+
+class JsonFileBackend(CacheBackend):
+    """ cache of directory in json file inside the directory """
+
+    CACHE_FILENAME = '.htdircache'
+    LOCK_FILENAME = '.htdircache.lock'
+    VERSION = 5
+
+    def __init__(self, config):
+        self._config = config
+
+    def lock_filename(self, directory):
+        return directory + self.LOCK_FILENAME
+
+    def version(self, directory):
+        try:
+            stat = os.stat(directory + self.CACHE_FILENAME)
+        except OSError:
+            return None
+        return ListingCache.validator(stat), stat.st_mtime
+
+    def load(self, directory):
+        try:
+            data_file = open(directory + self.CACHE_FILENAME)
+        except IOError:
+            return None
+        with data_file:
+            try:
+                data = json.load(data_file)
+            except ValueError:
+                return None
+        if isinstance(data, dict) and data.get('version') == self.VERSION:
+            return dict((name, Record.unpack(name, item)) for name, item in data['items'].items())
+        return None
+
+    def save(self, directory, items, changed=None, deleted=None):
+        cachefile = directory + self.CACHE_FILENAME
+        packed = dict((name, item.pack()) for name, item in items.items())
+        data = json.dumps({'version': self.VERSION, 'items': packed}, ensure_ascii=False)
+        atomic_write(cachefile, data, self._config.mode_file)
+        # rename changed mtime of directory, cache file must stay newer to be fresh
+        os.utime(cachefile, None)
+
+    def remove(self, directory):
+        for filename in (self.CACHE_FILENAME, self.LOCK_FILENAME):
+            try:
+                os.unlink(directory + filename)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def move(self, directory, new_directory):
+        # cache files were moved together with directories
+        pass
+
+    def search(self, directories, query):
+        return NameIndex.shared(self._config.base_dir).search(self, directories, query)
+
+
+class SqliteBackend(CacheBackend):
+    """ cache of all directories in one sqlite database in folder of connector in base dir, one row per file,
+    search queries all directories at once
+    """
+
+    DB_FILENAME = 'cache.sqlite'
+    LOCKS_DIRNAME = 'cache.locks'
+    VERSION = 4
+
+    _backends = {}
+    _backends_lock = threading.Lock()
+
+    def __init__(self, base_dir):
+        self._base_dir = os.path.abspath(base_dir)
+        # journal of database is created and deleted by each write, in folder of connector it does not change
+        # mtime of base dir
+        self._db = state_dir(self._base_dir, create=True) + self.DB_FILENAME
+        self._locks_dir = state_dir(self._base_dir) + self.LOCKS_DIRNAME
+        self._local = threading.local()
+        if self._execute('PRAGMA user_version').fetchone()[0] != self.VERSION:
+            # items of older version cannot be read, directories are scanned again
+            self._execute('DROP TABLE IF EXISTS items')
+            self._execute('DROP TABLE IF EXISTS dirs')
+            self._execute('DROP TABLE IF EXISTS counters')
+            self._execute('PRAGMA user_version = %d' % self.VERSION)
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS items (dir TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL, '
+            'PRIMARY KEY (dir, name))')
+        self._execute('CREATE INDEX IF NOT EXISTS items_name ON items (name)')
+        self._execute(
+            'CREATE TABLE IF NOT EXISTS dirs (dir TEXT PRIMARY KEY, saved REAL NOT NULL, '
+            'generation INTEGER NOT NULL)')
+        # generations of all directories are taken from one counter, generation of removed and rebuilt
+        # directory differs from generations kept in memory of other processes
+        self._execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        self._execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('generation', 0)")
+
+    @classmethod
+    def get(cls, config):
+        """ returns backend shared by all requests with the same base dir
+        :param config: instance of Config
+        """
+        base_dir = os.path.abspath(config.base_dir)
+        with cls._backends_lock:
+            if base_dir not in cls._backends:
+                cls._backends[base_dir] = cls(base_dir)
+            return cls._backends[base_dir]
+
+    def _connection(self):
+        """ returns connection of current thread, connections are not shared with forked processes """
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._db, timeout=30, isolation_level=None)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _execute(self, sql, params=()):
+        return self._connection().execute(sql, params)
+
+    @staticmethod
+    def _next_generation(connection):
+        """ returns new generation, caller holds write transaction """
+        connection.execute("UPDATE counters SET value = value + 1 WHERE name = 'generation'")
+        return connection.execute("SELECT value FROM counters WHERE name = 'generation'").fetchone()[0]
+
+    def _relative(self, directory):
+        path = os.path.relpath(os.path.abspath(directory), self._base_dir).replace(os.sep, '/')
+        path = '' if path == '.' else path
+        return path.decode('utf-8') if isinstance(path, str) else path
+
+    def lock_filename(self, directory):
+        try:
+            os.makedirs(self._locks_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        key = hashlib.sha1(self._relative(directory).encode('utf-8')).hexdigest()
+        return os.path.join(self._locks_dir, key + '.lock')
+
+    def version(self, directory):
+        row = self._execute('SELECT generation, saved FROM dirs WHERE dir = ?',
+                            (self._relative(directory),)).fetchone()
+        return None if row is None else (row[0], row[1])
+
+    def load(self, directory):
+        relative = self._relative(directory)
+        if self._execute('SELECT 1 FROM dirs WHERE dir = ?', (relative,)).fetchone() is None:
+            return None
+        rows = self._execute('SELECT name, data FROM items WHERE dir = ?', (relative,))
+        return dict((name, Record.unpack(name, json.loads(data))) for name, data in rows)
+
+    def save(self, directory, items, changed=None, deleted=None):
+        relative = self._relative(directory)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            if changed is None:
+                connection.execute('DELETE FROM items WHERE dir = ?', (relative,))
+                changed = items.keys()
+            for name in deleted or ():
+                connection.execute('DELETE FROM items WHERE dir = ? AND name = ?', (relative, name))
+            connection.executemany(
+                'INSERT OR REPLACE INTO items (dir, name, data) VALUES (?, ?, ?)',
+                [(relative, name, json.dumps(items[name].pack())) for name in changed if name in items])
+            connection.execute('INSERT OR REPLACE INTO dirs (dir, saved, generation) VALUES (?, ?, ?)',
+                               (relative, time.time(), SqliteBackend._next_generation(connection)))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def remove(self, directory):
+        relative = self._relative(directory)
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM items WHERE dir = ?', (relative,))
+            connection.execute('DELETE FROM dirs WHERE dir = ?', (relative,))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        try:
+            os.unlink(self.lock_filename(directory))
+        except OSError:
+            pass
+
+    def move(self, directory, new_directory):
+        relative = self._relative(directory)
+        new_relative = self._relative(new_directory)
+        start = len(relative) + 1
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for table in ('items', 'dirs'):
+                connection.execute('DELETE FROM %s WHERE dir = ? OR substr(dir, 1, ?) = ?' % table,
+                                   (new_relative, len(new_relative) + 1, new_relative + '/'))
+                connection.execute('UPDATE %s SET dir = ? || substr(dir, ?) WHERE dir = ? OR substr(dir, 1, ?) = ?'
+                                   % table, (new_relative, start, relative, start, relative + '/'))
+            # generation must differ from any previous cache of new path kept in memory of processes
+            connection.execute('UPDATE dirs SET generation = ? WHERE dir = ? OR substr(dir, 1, ?) = ?',
+                               (SqliteBackend._next_generation(connection), new_relative, len(new_relative) + 1,
+                                new_relative + '/'))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def search(self, directories, query):
+        condition, params = query.sql('name')
+        rows = self._execute('SELECT dir, name FROM items WHERE ' + condition + ' ORDER BY dir, name', params)
+        result = []
+        for directory, name in rows:
+            relative = directory + '/' if directory else ''
+            if relative in directories:
+                result.append((relative, name))
+        return result
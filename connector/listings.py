@@ -0,0 +1,110 @@
+"""
+listings ListingCache
+
+"""
+from collections import OrderedDict
+import threading
+
+
+class ListingCache(object):
+    """ process-wide LRU of parsed directory caches, entry is valid while cache file is not changed """
+
+    _shared = None
+
+    def __init__(self, max_size=256):
+        """
+        :param max_size: max. number of cached directories
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls):
+        """ returns cache shared by all requests in process """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    @staticmethod
+    def validator(stat):
+        """ returns value identifying version of cache file
+        :param stat: result of os.stat of cache file
+        """
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    def get(self, directory, validator):
+        """ returns copy of cached items of directory, None if they are not cached or cache file changed
+        :param directory: absolute path of directory
+        :param validator: current validator of cache file
+        """
+        with self._lock:
+            entry = self._entries.pop(directory, None)
+            if entry is None or entry[0] != validator:
+                self.misses += 1
+                return None
+            self._entries[directory] = entry
+            self.hits += 1
+            return dict(entry[1])
+
+    def put(self, directory, validator, items):
+        """ store items of directory
+        :param directory: absolute path of directory
+        :param validator: validator of cache file with items
+        :param items: dictionary of items
+        """
+        with self._lock:
+            self._entries.pop(directory, None)
+            self._entries[directory] = (validator, dict(items), {})
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_order(self, directory, validator, order):
+        """ returns sorted names of items of directory, None if they are not cached
+        :param directory: absolute path of directory
+        :param validator: current validator of cache file
+        :param order: key of order
+        """
+        with self._lock:
+            entry = self._entries.get(directory)
+            if entry is None or entry[0] != validator:
+                return None
+            return entry[2].get(order)
+
+    def put_order(self, directory, validator, order, names):
+        """ store sorted names of items of directory, names are kept until items change
+        :param directory: absolute path of directory
+        :param validator: validator of cache file with items
+        :param order: key of order
+        :param names: sorted names
+        """
+        with self._lock:
+            entry = self._entries.get(directory)
+            if entry is not None and entry[0] == validator:
+                entry[2][order] = names
+
+    def discard(self, directory):
+        """ remove directory from cache
+        :param directory: absolute path of directory
+        """
+        with self._lock:
+            self._entries.pop(directory, None)
+
+    def clear(self):
+        """ remove all directories and reset counters """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """ returns dictionary with counters of hits and misses and size of cache """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+                'max_size': self.max_size
+            }
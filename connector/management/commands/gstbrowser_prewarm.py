@@ -0,0 +1,43 @@
+"""
+gstbrowser_prewarm command
+
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from connector.prewarm import prewarm
+from connector.views import CONFIGS
+
+
+class Command(BaseCommand):
+    help = 'Build caches of folders and thumbnails of images of one config, interrupted run can be started ' \
+           'again and continues with remaining folders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('config', nargs='?', default='default', help='name of config')
+        parser.add_argument('--workers', type=int, default=4, help='number of processes, 0 for none')
+        parser.add_argument('--incremental', action='store_true',
+                            help='build only folders without cache or with stale cache')
+        parser.add_argument('--max-depth', type=int, default=None,
+                            help='max. level of nested folders, 0 for root folder only')
+        parser.add_argument('--restart', action='store_true', help='ignore state of interrupted run')
+
+    def handle(self, *args, **options):
+        name = options['config']
+        if name not in CONFIGS:
+            raise CommandError('unknown config: ' + name)
+        config = CONFIGS.get(name)
+        verbosity = options['verbosity']
+
+        def progress(path, files):
+            if verbosity > 1:
+                self.stdout.write('%s %d files' % (path or '/', files))
+
+        result = prewarm(config, options['workers'], options['incremental'], options['max_depth'],
+                         options['restart'], progress)
+        for path, error in result['errors']:
+            self.stderr.write('%s: %s' % (path or '/', error))
+        seconds = max(result['seconds'], 0.001)
+        self.stdout.write('%d folders, %d files, %d skipped in %.1f s, %.0f files/s' % (
+            result['directories'], result['files'], result['skipped'], seconds, result['files'] / seconds))
+        if result['errors']:
+            raise CommandError('%d folders failed, run command again to retry them' % len(result['errors']))
@@ -0,0 +1,34 @@
+"""
+gstbrowser_watch command
+
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from connector.views import CONFIGS
+from connector.watcher import Watcher, pyinotify
+
+
+class Command(BaseCommand):
+    help = 'Keep caches of configured roots fresh by inotify events, runs until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('configs', nargs='*', help='names of configs, all configs if empty')
+        parser.add_argument('--delay', type=float, default=1.0,
+                            help='seconds without events after which changes are applied')
+        parser.add_argument('--max-delay', type=float, default=10.0,
+                            help='max. seconds for which changes are collected during continuous events')
+
+    def handle(self, *args, **options):
+        if pyinotify is None:
+            raise CommandError('pyinotify is not installed')
+        names = options['configs'] or CONFIGS.names()
+        unknown = [name for name in names if name not in CONFIGS]
+        if unknown:
+            raise CommandError('unknown config: ' + ', '.join(unknown))
+        configs = [config for config in (CONFIGS.get(name) for name in names) if config.base_dir]
+        watcher = Watcher(configs, options['delay'], options['max_delay'])
+        self.stdout.write('watching ' + ', '.join(config.base_dir for config in configs))
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            watcher.flush()
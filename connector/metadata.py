@@ -0,0 +1,225 @@
+"""
+metadata Extractor, register, read_exif, read_header, read_pixels, orient, blurhash
+
+Metadata of images are read by extractors in two stages. Header extractors use values parsed by
+Image.open, pixel extractors get thumbnail decoded for ThumbnailStore, so image is decoded only once.
+Values are stored with record of file in cache of directory.
+
+"""
+import math
+
+from PIL import Image
+
+EXIF_ORIENTATION = 274
+EXIF_DATETIME = 306
+EXIF_DATETIME_ORIGINAL = 36867
+
+# transpositions of image turning EXIF orientation to 1
+ORIENTATIONS = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.TRANSPOSE],
+    6: [Image.ROTATE_270],
+    7: [Image.TRANSVERSE],
+    8: [Image.ROTATE_90]
+}
+
+BASE83 = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~'
+
+
+def read_exif(im):
+    """ returns dictionary tag -> value of EXIF of opened image, empty if image has no EXIF
+    :param im: image opened by Image.open
+    """
+    try:
+        # _getexif of jpeg and webp contains tags of Exif IFD, i.e. DateTimeOriginal
+        exif = im._getexif() if hasattr(im, '_getexif') else im.getexif()
+    except Exception:
+        # corrupted EXIF raises errors of any type
+        return {}
+    return exif or {}
+
+
+class Extractor(object):
+    """ base of metadata extractors, subclass sets name of value and returns value by extract() """
+
+    # key of value in metadata
+    name = None
+    # True if extractor needs decoded pixels, False if it reads only header
+    pixels = False
+
+    def extract(self, im, exif):
+        """ returns value or None if image does not have it
+        :param im: opened image for header extractors, decoded and oriented thumbnail for pixel extractors
+        :param exif: dictionary with EXIF of image, empty for pixel extractors
+        """
+        raise NotImplementedError
+
+
+class ExifOrientation(Extractor):
+    """ EXIF orientation 2 - 8, thumbnails are already rotated """
+
+    name = 'orientation'
+
+    def extract(self, im, exif):
+        orientation = exif.get(EXIF_ORIENTATION)
+        return orientation if orientation in ORIENTATIONS else None
+
+
+class ExifDate(Extractor):
+    """ date of capture as ISO8601 without time zone """
+
+    name = 'taken'
+
+    def extract(self, im, exif):
+        value = exif.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        if not isinstance(value, basestring) or len(value) < 19:
+            return None
+        value = value[:19].replace(':', '-', 2).replace(' ', 'T', 1)
+        return value if value[:4].isdigit() and value[4] == '-' else None
+
+
+class Placeholder(Extractor):
+    """ blurhash of thumbnail, client paints it until thumbnail is loaded """
+
+    name = 'blurhash'
+    pixels = True
+
+    # size of image from which hash is computed, more pixels do not change it visibly
+    SIZE = 16
+
+    def extract(self, im, exif):
+        x_components, y_components = (4, 3) if im.size[0] >= im.size[1] else (3, 4)
+        im = im.convert('RGB') if im.mode != 'RGB' else im
+        im = im.resize((self.SIZE, self.SIZE), Image.BILINEAR)
+        return blurhash(list(im.getdata()), self.SIZE, self.SIZE, x_components, y_components)
+
+
+class AverageColor(Extractor):
+    """ average colour of thumbnail as #rrggbb """
+
+    name = 'color'
+    pixels = True
+
+    def extract(self, im, exif):
+        im = im.convert('RGB') if im.mode != 'RGB' else im
+        return '#%02x%02x%02x' % im.resize((1, 1), Image.BOX).getpixel((0, 0))
+
+
+EXTRACTORS = [ExifOrientation(), ExifDate(), Placeholder(), AverageColor()]
+
+
+def register(extractor):
+    """ add extractor used for all images, value of extractor with the same name is replaced
+    :param extractor: instance of Extractor
+    """
+    EXTRACTORS[:] = [item for item in EXTRACTORS if item.name != extractor.name] + [extractor]
+
+
+def read_header(im, exif=None):
+    """ returns dictionary with values of header extractors
+    :param im: image opened by Image.open
+    :param exif: EXIF already read by read_exif, None reads it
+    """
+    if exif is None:
+        exif = read_exif(im)
+    return _extract(im, exif, False)
+
+
+def read_pixels(im):
+    """ returns dictionary with values of pixel extractors
+    :param im: decoded thumbnail
+    """
+    return _extract(im, {}, True)
+
+
+def _extract(im, exif, pixels):
+    result = {}
+    for extractor in EXTRACTORS:
+        if extractor.pixels == pixels:
+            value = extractor.extract(im, exif)
+            if value is not None:
+                result[extractor.name] = value
+    return result
+
+
+def orient(im, orientation):
+    """ returns image turned according to EXIF orientation
+    :param im: decoded image
+    :param orientation: EXIF orientation, None or 1 returns image unchanged
+    """
+    for method in ORIENTATIONS.get(orientation, ()):
+        im = im.transpose(method)
+    return im
+
+
+def blurhash(pixels, width, height, x_components, y_components):
+    """ returns blurhash (https://blurha.sh) of image
+    :param pixels: list of (r, g, b) tuples, row by row
+    :param width: width of image
+    :param height: height of image
+    :param x_components: number of horizontal components, 1 - 9
+    :param y_components: number of vertical components, 1 - 9
+    """
+    linear = [_srgb_to_linear(value) for value in range(256)]
+    cos_x = [[math.cos(math.pi * i * x / width) for x in range(width)] for i in range(x_components)]
+    cos_y = [[math.cos(math.pi * j * y / height) for y in range(height)] for j in range(y_components)]
+
+    # basis is product of horizontal and vertical cosines, rows are summed first
+    rows = [[[0.0, 0.0, 0.0] for _ in range(height)] for _ in range(x_components)]
+    for y in range(height):
+        row = pixels[y * width:(y + 1) * width]
+        for i in range(x_components):
+            total = rows[i][y]
+            for x, (r, g, b) in enumerate(row):
+                basis = cos_x[i][x]
+                total[0] += basis * linear[r]
+                total[1] += basis * linear[g]
+                total[2] += basis * linear[b]
+
+    factors = []
+    for j in range(y_components):
+        for i in range(x_components):
+            scale = (1.0 if i == 0 and j == 0 else 2.0) / (width * height)
+            factor = [0.0, 0.0, 0.0]
+            for y in range(height):
+                basis = cos_y[j][y] * scale
+                for channel in range(3):
+                    factor[channel] += basis * rows[i][y][channel]
+            factors.append(factor)
+
+    dc, ac = factors[0], factors[1:]
+    result = _base83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised = max(0, min(82, int(math.floor(max(abs(value) for factor in ac for value in factor) * 166 - 0.5))))
+        maximum = (quantised + 1) / 166.0
+        result += _base83(quantised, 1)
+    else:
+        maximum = 1.0
+        result += _base83(0, 1)
+    result += _base83((_linear_to_srgb(dc[0]) << 16) + (_linear_to_srgb(dc[1]) << 8) + _linear_to_srgb(dc[2]), 4)
+    for factor in ac:
+        quantised = [max(0, min(18, int(math.floor(_sign_pow(value / maximum, 0.5) * 9 + 9.5)))) for value in factor]
+        result += _base83(quantised[0] * 19 * 19 + quantised[1] * 19 + quantised[2], 2)
+    return result
+
+
+def _srgb_to_linear(value):
+    value /= 255.0
+    return value / 12.92 if value <= 0.04045 else ((value + 0.055) / 1.055) ** 2.4
+
+
+def _linear_to_srgb(value):
+    value = max(0.0, min(1.0, value))
+    if value <= 0.0031308:
+        return int(value * 12.92 * 255 + 0.5)
+    return int((1.055 * value ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exponent):
+    return math.copysign(abs(value) ** exponent, value)
+
+
+def _base83(value, length):
+    return ''.join(BASE83[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
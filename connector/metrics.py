@@ -0,0 +1,144 @@
+"""
+metrics Metrics, timer, count
+
+Process-wide timers and counters of connector. Disabled timers return shared no-op object, so
+instrumented code costs one function call when metrics are off.
+
+"""
+import threading
+import time
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    __slots__ = ('_metrics', '_family', '_name', '_start')
+
+    def __init__(self, metrics, family, name):
+        self._metrics = metrics
+        self._family = family
+        self._name = name
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._metrics.observe(self._family, self._name, time.time() - self._start)
+        return False
+
+
+class Metrics(object):
+    """ totals of timers and counters collected by process, timings of current request for
+    Server-Timing header. Timers are inclusive, i.e. refresh contains thumbnails of refreshed files
+    """
+
+    _shared = None
+
+    def __init__(self):
+        self.enabled = False
+        self.server_timing = False
+        self._timers = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def shared(cls):
+        """ returns metrics shared by all requests in process """
+        if cls._shared is None:
+            cls._shared = cls()
+        return cls._shared
+
+    def is_active(self):
+        """ returns True if anything is collected """
+        return self.enabled or self.server_timing
+
+    def timer(self, name, family='operation'):
+        """ returns context manager measuring time of its block
+        :param name: name of operation
+        :param family: 'operation' for parts of request, 'action' for whole request
+        """
+        if not self.enabled and not self.server_timing:
+            return _NULL_TIMER
+        return _Timer(self, family, name)
+
+    def observe(self, family, name, seconds):
+        """ add duration of one call
+        :param family: 'operation' or 'action'
+        :param name: name of operation or action
+        :param seconds: duration of call
+        """
+        if self.enabled:
+            with self._lock:
+                total = self._timers.setdefault((family, name), [0, 0.0])
+                total[0] += 1
+                total[1] += seconds
+        timings = getattr(self._local, 'timings', None)
+        if timings is not None and family == 'operation':
+            timings[name] = timings.get(name, 0.0) + seconds
+
+    def count(self, name, value=1):
+        """ increase counter
+        :param name: name of counter
+        :param value: increment
+        """
+        if self.enabled:
+            with self._lock:
+                self._counters[name] = self._counters.get(name, 0) + value
+
+    def start_request(self):
+        """ start collecting timings of request handled by current thread """
+        if self.server_timing:
+            self._local.timings = {}
+
+    def end_request(self):
+        """ stop collecting timings of request, returns dictionary name -> seconds """
+        timings = getattr(self._local, 'timings', None)
+        self._local.timings = None
+        return timings or {}
+
+    def prometheus(self):
+        """ returns totals in Prometheus text format """
+        with self._lock:
+            timers = sorted(self._timers.items())
+            counters = sorted(self._counters.items())
+        lines = []
+        for family in ('action', 'operation'):
+            metric = 'gstbrowser_%s_seconds' % family
+            lines.append('# TYPE %s summary' % metric)
+            for (timer_family, name), (calls, seconds) in timers:
+                if timer_family == family:
+                    lines.append('%s_count{%s="%s"} %d' % (metric, family, name, calls))
+                    lines.append('%s_sum{%s="%s"} %.6f' % (metric, family, name, seconds))
+        for name, value in counters:
+            lines.append('# TYPE gstbrowser_%s_total counter' % name)
+            lines.append('gstbrowser_%s_total %d' % (name, value))
+        return '\n'.join(lines) + '\n'
+
+
+def timer(name):
+    """ returns context manager measuring time of operation in shared metrics
+    :param name: name of operation
+    """
+    return Metrics.shared().timer(name)
+
+
+def count(name, value=1):
+    """ increase counter in shared metrics
+    :param name: name of counter
+    :param value: increment
+    """
+    Metrics.shared().count(name, value)
@@ -0,0 +1,97 @@
+"""
+mime sniff, is_raster
+
+Type of content is detected by signature in first bytes of file, extension is used only for files
+without known signature, i.e. text files.
+
+"""
+import mimetypes
+import os
+
+# system types are read once, not by first requests in parallel
+if not mimetypes.inited:
+    mimetypes.init()
+
+# number of bytes read from start of file
+HEAD_SIZE = 32
+
+DEFAULT = 'application/octet-stream'
+
+# images decoded by PIL for size, metadata and thumbnail
+RASTERS = frozenset(('image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff',
+                     'image/x-icon'))
+
+# (offset, signature, mime type), the first matching signature wins
+SIGNATURES = (
+    (0, '\xff\xd8\xff', 'image/jpeg'),
+    (0, '\x89PNG\r\n\x1a\n', 'image/png'),
+    (0, 'GIF87a', 'image/gif'),
+    (0, 'GIF89a', 'image/gif'),
+    (0, 'II*\x00', 'image/tiff'),
+    (0, 'MM\x00*', 'image/tiff'),
+    (0, '\x00\x00\x01\x00', 'image/x-icon'),
+    (0, '8BPS', 'image/vnd.adobe.photoshop'),
+    (0, '%PDF-', 'application/pdf'),
+    (0, '%!PS', 'application/postscript'),
+    (0, '\x1f\x8b', 'application/gzip'),
+    (0, 'BZh', 'application/x-bzip2'),
+    (0, '\xfd7zXZ\x00', 'application/x-xz'),
+    (0, '7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, 'Rar!\x1a\x07', 'application/vnd.rar'),
+    (0, 'OggS', 'audio/ogg'),
+    (0, 'fLaC', 'audio/flac'),
+    (0, 'ID3', 'audio/mpeg'),
+    (0, '\x1aE\xdf\xa3', 'video/webm'),
+    (4, 'ftypqt', 'video/quicktime'),
+    (4, 'ftypheic', 'image/heic'),
+    (4, 'ftyp', 'video/mp4'),
+)
+
+# RIFF containers have type of content at offset 8
+RIFF = {'WEBP': 'image/webp', 'WAVE': 'audio/wav', 'AVI ': 'video/x-msvideo'}
+
+# ZIP signature is shared by office documents, jar, epub... their type is given by extension
+ZIP = 'PK\x03\x04'
+
+# header sizes of BMP variants, two bytes 'BM' alone match too many text files
+BMP_HEADERS = (12, 40, 52, 56, 64, 108, 124)
+
+
+def sniff(filename, head=None):
+    """ returns mime type of file
+    :param filename: full path to file, extension is used for files without known signature
+    :param head: first HEAD_SIZE bytes of file, None reads them
+    :raise IOError: if file cannot be read
+    """
+    if head is None:
+        with open(filename, 'rb') as data_file:
+            head = data_file.read(HEAD_SIZE)
+
+    for offset, signature, mime in SIGNATURES:
+        if head.startswith(signature, offset):
+            return mime
+    if head.startswith('RIFF') and head[8:12] in RIFF:
+        return RIFF[head[8:12]]
+    if head.startswith('BM') and len(head) >= 18 and ord(head[14]) in BMP_HEADERS and head[15:18] == '\x00\x00\x00':
+        return 'image/bmp'
+
+    guessed = _guess(filename)
+    if head.startswith(ZIP):
+        return guessed or 'application/zip'
+    if guessed is not None and guessed not in RASTERS:
+        # misnamed images are not trusted, images were matched by signature
+        return guessed
+    if head and '\x00' not in head:
+        return 'text/plain'
+    return DEFAULT
+
+
+def is_raster(mime):
+    """ returns True if mime type is image decoded by PIL
+    :param mime: mime type returned by sniff
+    """
+    return mime in RASTERS
+
+
+def _guess(filename):
+    return mimetypes.guess_type(os.path.basename(filename), strict=False)[0]
@@ -4,31 +4,65 @@ models Config, Connector
 """
 import os
 from os.path import isdir, isfile
-import glob
-import json
-from datetime import datetime
-from StringIO import StringIO
-import base64
+import copy
+import hashlib
 import time
 import errno
 import unicodedata
 import shutil
 import re
+import threading
+from contextlib import contextmanager
+from itertools import islice
 
 from PIL import Image
-import pytz
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from connector.backends import JsonFileBackend, get_backend
+from connector.listings import ListingCache
+from connector.metadata import read_header, read_pixels
+from connector.metrics import count, timer
+from connector.mime import HEAD_SIZE, is_raster, sniff
+from connector.records import Record
+from connector.search import NameIndex, NameQuery
+from connector.thumbnails import ThumbnailQueue, ThumbnailStore, render_thumbnail
+from connector.transfer import copy_file, copy_tree, move_tree
+from connector.tree import TreeIndex
+from connector.uploads import ChunkedUpload, write_upload
+from connector.utils import relative_path
 
 
 class Config(object):
-    """ configuration of connector """
+    """ configuration of connector, frozen config cannot be changed and is shared by requests """
 
     def __init__(self, base_dir):
+        self._frozen = False
+        self._real_base_dir = None
         self.base_dir = base_dir.strip()
         self.mode_dir = 0755
         self.mode_file = 0644
         self.overwrite = True
         self._thumb_max_width = 90
         self._thumb_max_height = 90
+        self.thumb_workers = 2
+        self.thumb_queue_size = 1000
+        self.thumb_timeout = 60
+        self.thumb_url = '?action=thumb'
+        self.cache_ttl = 7200
+        self.tree_ttl = None
+        self.cache_backend = 'json'
+        self.max_upload_size = None
+        self.stream_responses = False
+        self.cache_control = 'private, no-cache'
 
     @property
     def thumb_max_width(self):
@@ -56,6 +90,39 @@ class Config(object):
         if 20 <= value <= 400:
             self._thumb_max_height = value
 
+    @property
+    def real_base_dir(self):
+        """ returns base dir with resolved symbolic links and without trailing slash, frozen config
+        resolves it once
+        """
+        if self._real_base_dir is not None:
+            return self._real_base_dir
+        return os.path.realpath(self.base_dir)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError('config is frozen, use replace() to change ' + name)
+        object.__setattr__(self, name, value)
+
+    def freeze(self):
+        """ normalize base dir to path with trailing slash and make config immutable, returns config """
+        if self.base_dir and not self.base_dir.endswith('/'):
+            self.base_dir += '/'
+        self._real_base_dir = os.path.realpath(self.base_dir)
+        self._frozen = True
+        return self
+
+    def replace(self, **values):
+        """ returns copy of config with changed values, copy of frozen config is frozen
+        :param values: names and new values of attributes
+        """
+        config = copy.copy(self)
+        object.__setattr__(config, '_frozen', False)
+        config._real_base_dir = None
+        for name, value in values.items():
+            setattr(config, name, value)
+        return config.freeze() if self._frozen else config
+
 
 class Connector:
     """ connector """
@@ -73,6 +140,9 @@ class Connector:
     ERR_UPLOAD = 30
     ERR_UPLOAD_FILESIZE = 31
     ERR_UPLOAD_FILE_EXISTS = 32
+    ERR_UPLOAD_OFFSET = 33
+    ERR_UPLOAD_NOT_FOUND = 34
+    ERR_UPLOAD_INCOMPLETE = 35
 
     ERR_DELETE = 40
     ERR_DELETE_NOT_EMPTY_DIR = 41
@@ -84,46 +154,157 @@ class Connector:
     def __init__(self, config):
         self._config = config
 
-    def get_folders_tree(self):
-        """ returns tree of all folders """
+    def get_folders_tree(self, path='', depth=None):
+        """ returns tree of folders
+        :param path: relative path of folder to expand, empty for all folders
+        :param depth: max. number of returned levels of nested folders, None for unlimited
+        """
         if not os.path.isdir(self._config.base_dir):
             return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
-        return Connector._output(0, None, self._get_tree())
+        if depth is not None and depth < 0:
+            return Connector._output(self.ERR_INVALID_PARAMETER)
+        tree = self._tree_index().get_tree(path, depth, self._config.stream_responses)
+        if tree is None:
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+        return Connector._output(0, None, tree)
+
+    def get_tree_etag(self, path='', depth=None):
+        """ returns entity tag of result of get_folders_tree, it changes when any folder is created, renamed
+        or deleted. None if result is an error
+        :param path: relative path of folder to expand, empty for all folders
+        :param depth: max. number of returned levels of nested folders, None for unlimited
+        """
+        if not os.path.isdir(self._config.base_dir) or (depth is not None and depth < 0):
+            return None
+        return Connector._etag('tree', self._config.base_dir, self._tree_index().version(), path, depth)
+
+    def get_files_etag(self, path, offset=0, limit=None, sort='name', order='asc'):
+        """ returns entity tag of result of get_files, it changes with each change of cache of folder.
+        None if result is an error
+        :param path: relative path
+        :param offset: number of skipped files
+        :param limit: max. number of returned files, None for all
+        :param sort: 'name', 'date' or 'size'
+        :param order: 'asc' or 'desc'
+        """
+        target_dir = self._target_dir(path)
+        if not os.path.isdir(target_dir):
+            return None
+        cache = CacheDir(target_dir, self._config)
+        # totals of subfolders change without change of cache of folder
+        totals = sorted(self._tree_index().children_totals(path).items())
+        return Connector._etag('files', self._config.base_dir, cache.version(), totals, path, offset, limit, sort,
+                               order, self._config.thumb_url, self._config.thumb_max_width,
+                               self._config.thumb_max_height)
+
+    @staticmethod
+    def _etag(*values):
+        return '"' + hashlib.sha1(repr(values)).hexdigest() + '"'
 
     def _get_tree(self):
-        result = []
-        sub_tree = self._get_sub_tree(self._config.base_dir)
-        tmp = {'name': os.path.basename(os.path.normpath(self._config.base_dir))}
-        if sub_tree:
-            tmp['children'] = sub_tree
-        result.append(tmp)
-        return result
+        return self._tree_index().get_tree()
 
-    def _get_sub_tree(self, current_directory):
-        result = []
-        for sub_dir in os.listdir(current_directory):
-            if os.path.isdir(current_directory + sub_dir):
-                tmp = {'name': os.path.basename(sub_dir)}
-                sub_tree = self._get_sub_tree(current_directory + sub_dir + '/')
-                if sub_tree:
-                    tmp['children'] = sub_tree
-                result.append(tmp)
-        return result
+    def _tree_index(self):
+        return TreeIndex.shared(self._config)
 
-    def get_files(self, path):
-        """ returns list of files in path
+    def get_files(self, path, offset=0, limit=None, sort='name', order='asc'):
+        """ returns list of files in path, folders first
         :param path: relative path
+        :param offset: number of skipped files
+        :param limit: max. number of returned files, None for all
+        :param sort: 'name', 'date' or 'size'
+        :param order: 'asc' or 'desc'
         """
         target_dir = self._target_dir(path)
         if not os.path.isdir(target_dir):
             return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
-        return Connector._output(0, self._get_folder_content(target_dir))
+        if sort not in CacheDir.SORT_KEYS or order not in ('asc', 'desc') or offset < 0 \
+                or (limit is not None and limit < 0):
+            return Connector._output(self.ERR_INVALID_PARAMETER)
+
+        cache = CacheDir(target_dir, self._config)
+        items = cache.get_files(sort, order == 'desc')
+        totals = self._tree_index().children_totals(path)
+        end = None if limit is None else offset + limit
+        if self._config.stream_responses:
+            # entries are formatted while response is sent
+            files = (self._format_item(item, cache.path(), totals) for item in islice(items, offset, end))
+        else:
+            files = [self._format_item(item, cache.path(), totals) for item in items[offset:end]]
+        return Connector._output(0, files, total=len(items))
+
+    def search(self, query, mode='substring', offset=0, limit=None):
+        """ returns files and folders in all folders with name matching query, each file has property
+        "path" with relative path of its folder
+        :param query: searched text, glob pattern or comma separated extensions
+        :param mode: 'substring', 'glob' or 'ext'
+        :param offset: number of skipped files
+        :param limit: max. number of returned files, None for all
+        """
+        name_query = NameQuery(query, mode)
+        if not name_query.is_valid() or offset < 0 or (limit is not None and limit < 0):
+            return Connector._output(self.ERR_INVALID_PARAMETER)
+        if not os.path.isdir(self._config.base_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+
+        backend = get_backend(self._config)
+        cached = {}
+        listed = {}
+        for path in self._tree_index().paths():
+            directory = self._target_dir(path)
+            if backend.version(directory.rstrip('/') + '/') is None:
+                listed[path] = directory
+            else:
+                cached[path] = directory
+        # folders without cache are not scanned into cache, only their names are listed
+        found = backend.search(cached, name_query)
+        found.extend(NameIndex.shared(self._config.base_dir).search_listed(listed, name_query))
+        found.sort()
+
+        end = None if limit is None else offset + limit
+        files = []
+        caches = {}
+        totals = {}
+        for path, name in found[offset:end]:
+            if path not in totals:
+                if path in cached:
+                    caches[path] = CacheDir(cached[path], self._config)
+                totals[path] = self._tree_index().children_totals(path)
+            if path in caches:
+                item = caches[path].get_item(name)
+            else:
+                item = Connector._read_record(listed[path] + name, self._config)
+            if item is not None:
+                item = self._format_item(item, path, totals[path])
+                item['path'] = path
+                files.append(item)
+        return Connector._output(0, files, total=len(found))
+
+    @staticmethod
+    def _read_record(full_path, config):
+        """ returns record of found file in folder without cache, None if it was deleted meanwhile """
+        try:
+            return File(full_path, config).get_record()
+        except OSError:
+            return None
 
     def _target_dir(self, path):
         return self._config.base_dir + path
 
+    def is_inside(self, *paths):
+        """ returns True if all relative paths stay in base dir, paths are not resolved on disk
+        :param paths: relative paths, i.e. with parent references
+        """
+        root = self._config.real_base_dir
+        prefix = root.rstrip('/') + '/'
+        for path in paths:
+            target = os.path.normpath(os.path.join(root, path))
+            if target != root and not target.startswith(prefix):
+                return False
+        return True
+
     @staticmethod
-    def _output(err=0, files=None, tree=None):
+    def _output(err=0, files=None, tree=None, **extra):
         ret = {'status': ('OK' if err == 0 else 'ERR')}
         if err > 0:
             ret['err'] = err
@@ -131,11 +312,54 @@ class Connector:
             ret['files'] = files
         if tree is not None:
             ret['tree'] = tree
+        for key, value in extra.items():
+            if value is not None:
+                ret[key] = value
         return ret
 
     def _get_folder_content(self, target_dir):
         cache = CacheDir(target_dir, self._config)
-        return cache.get_files()
+        totals = self._tree_index().children_totals(target_dir[len(self._config.base_dir):])
+        return [self._format_item(item, cache.path(), totals) for item in cache.get_files()]
+
+    def _format_item(self, item, path, totals=None):
+        """ returns item formatted for response, folders get total size and number of files
+        :param item: instance of Record
+        :param path: relative path of folder of item with trailing slash, returned by CacheDir.path
+        :param totals: dictionary name -> (size, files) of subfolders returned by TreeIndex.children_totals
+        """
+        result = item.format(self._config, path)
+        if totals is not None and item.type == 'dir' and item.name in totals:
+            result['size'], result['files'] = totals[item.name]
+        return result
+
+    @staticmethod
+    def _file_totals(full_path):
+        """ returns tuple (size, 1) for file, (0, 0) for folder or missing file, changes are added to totals
+        of folders in tree
+        :param full_path: full path to file
+        """
+        if not os.path.isfile(full_path):
+            return 0, 0
+        return os.path.getsize(full_path), 1
+
+    def _update_totals(self, path, before, after, since):
+        """ add change of files in folder to totals of folder and its parents
+        :param path: relative path of folder
+        :param before: tuple (size, files) of changed files before change
+        :param after: tuple (size, files) of changed files after change
+        :param since: time before change on disk, index rebuilt later already contains it
+        """
+        self._tree_index().update_totals(path, after[0] - before[0], after[1] - before[1], since)
+
+    def get_thumbnail(self, key):
+        """ returns full path to stored thumbnail, None if thumbnail does not exist
+        :param key: key of thumbnail
+        """
+        if not ThumbnailStore.is_key(key):
+            return None
+        store = ThumbnailStore(self._config.base_dir)
+        return store.filename(key) if store.exists(key) else None
 
     def mk_dir(self, path, new_dir):
         """ create new directory
@@ -153,6 +377,8 @@ class Connector:
         if os.path.isdir(fullpath):
             return Connector._output(self.ERR_MKDIR_EXISTS)
 
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
+        cache = CacheDir(target_dir, self._config)
         oldumask = os.umask(0)
         try:
             os.mkdir(fullpath, self._config.mode_dir)
@@ -160,8 +386,8 @@ class Connector:
             return Connector._output(self.ERR_MKDIR)
 
         os.umask(oldumask)
-        cache = CacheDir(target_dir, self._config)
         cache.update_item(new_dir)
+        self._tree_index().add(path, new_dir)
 
         return Connector._output(0, self._get_folder_content(target_dir), self._get_tree())
 
@@ -174,29 +400,176 @@ class Connector:
         if not os.path.isdir(target_dir):
             return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
 
-        filename = uploaded_file.name
-        filename = File.remove_accents(filename)
-        filename = filename.replace(' ', '-')
+        filename = Connector._upload_filename(uploaded_file.name)
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
+        cache = CacheDir(target_dir, self._config)
+        started = time.time()
+        before = Connector._file_totals(target_dir + filename)
+        err, digest = self._write_upload(target_dir, filename, uploaded_file)
+        if err:
+            return Connector._output(err)
+
+        cache.update_item(filename)
+        self._update_totals(path, before, Connector._file_totals(target_dir + filename), started)
 
+        return Connector._output(0, self._get_folder_content(target_dir), hash=digest)
+
+    def upload_many(self, path, uploaded_files):
+        """ upload more files in one request, cache of directory is written once
+        :param path: relative path
+        :param uploaded_files: list of uploaded file fields
+        """
+        target_dir = self._target_dir(path)
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
+        cache = CacheDir(target_dir, self._config)
+        items = []
+        done = []
+        before = [0, 0]
+        after = [0, 0]
+        started = time.time()
+        for uploaded_file in uploaded_files:
+            filename = Connector._upload_filename(uploaded_file.name)
+            totals = Connector._file_totals(target_dir + filename)
+            err, digest = self._write_upload(target_dir, filename, uploaded_file)
+            item = Connector._item_status(filename, err)
+            if err == 0:
+                item['hash'] = digest
+                done.append(filename)
+                Connector._add(before, totals)
+                Connector._add(after, Connector._file_totals(target_dir + filename))
+            items.append(item)
+
+        if done:
+            cache.update_items(done)
+            self._update_totals(path, before, after, started)
+        return Connector._output(0, self._get_folder_content(target_dir), items=items)
+
+    @staticmethod
+    def _upload_filename(name):
+        filename = File.remove_accents(name)
+        return filename.replace(' ', '-')
+
+    @staticmethod
+    def _is_upload_filename(filename):
+        """ returns True if uploaded file can be saved under filename, hidden files and paths are rejected """
+        return bool(filename) and not filename.startswith('.') and os.path.basename(filename) == filename
+
+    def _is_upload_conflict(self, target):
+        """ returns True if uploaded file cannot replace target, folders are never replaced
+        :param target: full path to uploaded file
+        """
+        return os.path.isdir(target) or (not self._config.overwrite and os.path.exists(target))
+
+    def _write_upload(self, target_dir, filename, uploaded_file):
+        """ returns tuple (err, sha1 of content)
+        :param target_dir: full path to directory
+        :param filename: name of file
+        :param uploaded_file: uploaded file field
+        """
         target_fullpath = target_dir + filename
-        if not self._config.overwrite and isfile(target_fullpath):
+        if not Connector._is_upload_filename(filename):
+            return self.ERR_INVALID_PARAMETER, None
+        if self._is_upload_conflict(target_fullpath):
+            return self.ERR_UPLOAD_FILE_EXISTS, None
+        try:
+            return 0, write_upload(uploaded_file.chunks(), target_fullpath, self._config.mode_file)
+        except (IOError, OSError):
+            return self.ERR_UPLOAD, None
+
+    def upload_init(self, path, name, size=None):
+        """ start chunked upload, returns property "upload" with id of upload
+        :param path: relative path
+        :param name: name of uploaded file
+        :param size: expected size of file in bytes, None if it is unknown
+        """
+        target_dir = self._target_dir(path)
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+
+        filename = Connector._upload_filename(name)
+        if not Connector._is_upload_filename(filename):
+            return Connector._output(self.ERR_INVALID_PARAMETER)
+        if self._is_upload_conflict(target_dir + filename):
             return Connector._output(self.ERR_UPLOAD_FILE_EXISTS)
+        if size is not None and self._config.max_upload_size and size > self._config.max_upload_size:
+            return Connector._output(self.ERR_UPLOAD_FILESIZE)
 
-        with open(target_fullpath, 'wb+') as destination:
-            for chunk in uploaded_file.chunks():
-                destination.write(chunk)
+        upload = ChunkedUpload.create(self._config.base_dir, path, filename, size)
+        return Connector._output(0, upload=upload.id, offset=0)
 
-        oldumask = os.umask(0)
+    def upload_chunk(self, upload_id, offset, chunk_file):
+        """ append chunk to upload, returns property "offset" with number of received bytes
+        :param upload_id: id of upload returned by upload_init
+        :param offset: position of chunk in file
+        :param chunk_file: uploaded file field with content of chunk
+        """
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return Connector._output(self.ERR_UPLOAD_NOT_FOUND)
+
+        size = upload.meta()['size']
+        max_size = self._config.max_upload_size
+        if (size is not None and offset + chunk_file.size > size) or \
+                (max_size and offset + chunk_file.size > max_size):
+            return Connector._output(self.ERR_UPLOAD_FILESIZE, offset=upload.offset())
         try:
-            os.chmod(target_fullpath, self._config.mode_file)
-        except OSError:
-            pass
-        os.umask(oldumask)
+            appended = upload.append(offset, chunk_file.chunks())
+        except (IOError, OSError):
+            return Connector._output(self.ERR_UPLOAD)
+        if not appended:
+            return Connector._output(self.ERR_UPLOAD_OFFSET, offset=upload.offset())
+        return Connector._output(0, offset=upload.offset())
+
+    def upload_status(self, upload_id):
+        """ returns property "offset" with number of received bytes, client continues interrupted
+        upload from this offset
+        :param upload_id: id of upload returned by upload_init
+        """
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return Connector._output(self.ERR_UPLOAD_NOT_FOUND)
+        return Connector._output(0, offset=upload.offset(), size=upload.meta()['size'])
+
+    def upload_finalize(self, upload_id):
+        """ move received file to target folder, only uploaded file is updated in cache
+        :param upload_id: id of upload returned by upload_init
+        """
+        upload = self._get_upload(upload_id)
+        if upload is None:
+            return Connector._output(self.ERR_UPLOAD_NOT_FOUND)
+
+        meta = upload.meta()
+        if meta['size'] is not None and upload.offset() != meta['size']:
+            return Connector._output(self.ERR_UPLOAD_INCOMPLETE, offset=upload.offset())
+        target_dir = self._target_dir(meta['path'])
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+        if self._is_upload_conflict(target_dir + meta['name']):
+            return Connector._output(self.ERR_UPLOAD_FILE_EXISTS)
 
+        digest = upload.digest()
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
         cache = CacheDir(target_dir, self._config)
-        cache.refresh()
+        started = time.time()
+        before = Connector._file_totals(target_dir + meta['name'])
+        try:
+            upload.finish(target_dir + meta['name'], self._config.mode_file)
+        except (IOError, OSError):
+            return Connector._output(self.ERR_UPLOAD)
 
-        return Connector._output(0, self._get_folder_content(target_dir))
+        cache.update_item(meta['name'])
+        self._update_totals(meta['path'], before, Connector._file_totals(target_dir + meta['name']), started)
+
+        return Connector._output(0, self._get_folder_content(target_dir), hash=digest)
+
+    def _get_upload(self, upload_id):
+        if not ChunkedUpload.is_id(upload_id):
+            return None
+        upload = ChunkedUpload(self._config.base_dir, upload_id)
+        return upload if upload.exists() else None
 
     def rename(self, path, old, new):
         """ rename folder or file
@@ -213,16 +586,27 @@ class Connector:
         if not os.path.isfile(src) and not is_dir:
             return Connector._output(self.ERR_FILE_NOT_FOUND)
 
+        # cache is loaded before changes on disk, otherwise renamed item would not be known
+        cache = CacheDir(target_dir, self._config)
+        started = time.time()
+        # file renamed over existing file replaces it
+        before = [0, 0]
+        for name in (old, new):
+            Connector._add(before, Connector._file_totals(target_dir + name))
         try:
             os.rename(src, target_dir + new)
         except OSError:
             return Connector._output(self.ERR_RENAME)
+        self._update_totals(path, before, Connector._file_totals(target_dir + new), started)
 
-        cache = CacheDir(target_dir, self._config)
+        if is_dir:
+            get_backend(self._config).move(target_dir + old + '/', target_dir + new + '/')
+        self._move_thumbnails(cache, old, cache.path(), new)
         cache.delete_item(old)
         cache.update_item(new)
 
         if is_dir:
+            self._tree_index().rename(path, old, new)
             return Connector._output(0, self._get_folder_content(target_dir), self._get_tree())
         return Connector._output(0, self._get_folder_content(target_dir))
 
@@ -234,103 +618,127 @@ class Connector:
         """
 
         target_dir = self._target_dir(path)
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+        is_dir = os.path.isdir(target_dir + '/' + name)
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
+        cache = CacheDir(target_dir, self._config)
+        started = time.time()
+        before = Connector._file_totals(target_dir + '/' + name)
+        err = self._delete_from_disk(target_dir, name)
+        if err > 0:
+            return Connector._output(err)
+
+        cache.delete_item(name)
+        self._update_totals(path, before, (0, 0), started)
+        if is_dir:
+            self._tree_index().remove(path, name)
+            return Connector._output(0, self._get_folder_content(target_dir), self._get_tree())
+        return Connector._output(0, self._get_folder_content(target_dir))
+
+    def _delete_from_disk(self, target_dir, name):
+        """ delete folder or file, returns error code or 0 """
         target = target_dir + '/' + name
 
         if os.path.isdir(target):
             try:
-                os.unlink(target + '/' + CacheDir.CACHE_FILENAME)
+                CacheDir.remove(target, self._config)
             except OSError:
-                return Connector._output(self.ERR_DELETE)
+                return self.ERR_DELETE
 
             try:
                 os.rmdir(target)
             except OSError as e:
                 if e.errno == errno.ENOTEMPTY:
-                    return Connector._output(self.ERR_DELETE_NOT_EMPTY_DIR)
+                    return self.ERR_DELETE_NOT_EMPTY_DIR
                 else:
-                    return Connector._output(self.ERR_DELETE)
-
-            cache = CacheDir(target_dir, self._config)
-            cache.delete_item(name)
-            return Connector._output(0, self._get_folder_content(target_dir), self._get_tree())
+                    return self.ERR_DELETE
+            return 0
         elif os.path.isfile(target):
             try:
                 os.unlink(target)
             except OSError:
-                return Connector._output(self.ERR_DELETE)
-
-            cache = CacheDir(target_dir, self._config)
-            cache.delete_item(name)
-            return Connector._output(0, self._get_folder_content(target_dir))
+                return self.ERR_DELETE
+            return 0
         else:
-            return Connector._output(self.ERR_FILE_NOT_FOUND)
+            return self.ERR_FILE_NOT_FOUND
+
+    def delete_many(self, path, names):
+        """ delete folders and files, cache and tree are updated once for all of them.
+        Returns property "items" with status of each name
 
-    def copy(self, path, name, new_target):
-        """ copy file to another folder
         :param path: relative path
-        :param name: file to copy
-        :param new_target: target folder or file
+        :param names: list of names of files or folders to delete
         """
         target_dir = self._target_dir(path)
-        target = target_dir + '/' + name
-        if os.path.isdir(target):
-            return Connector._output(self.ERR_INVALID_PARAMETER)
-        if os.path.isfile(target):
-            return Connector._output(self.ERR_FILE_NOT_FOUND)
-
-        copy_target_dir = self._target_dir('') + new_target
-
-        if os.path.isdir(copy_target_dir):
-            try:
-                shutil.copy(target, copy_target_dir + '/' + name)
-            except IOError:
-                return Connector._output(self.ERR_COPY)
-
-            cache = CacheDir(copy_target_dir, self._config)
-            cache.update_item(name)
-            return Connector._output(0)
-        else:
-            if os.path.isfile(copy_target_dir):
-                return Connector._output(self.ERR_COPY_FILE_EXISTS)
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
 
-            if not os.path.isdir(os.path.dirname(copy_target_dir)):
-                return Connector._output(self.ERR_COPY_DIR_NOT_FOUND)
+        # cache is loaded before changes on disk, otherwise changed directory would be scanned again
+        cache = CacheDir(target_dir, self._config)
+        items = []
+        deleted = []
+        deleted_dirs = []
+        before = [0, 0]
+        started = time.time()
+        for name in names:
+            is_dir = os.path.isdir(target_dir + '/' + name)
+            totals = Connector._file_totals(target_dir + '/' + name)
+            err = self._delete_from_disk(target_dir, name) if name else self.ERR_INVALID_PARAMETER
+            items.append(Connector._item_status(name, err))
+            if err == 0:
+                deleted.append(name)
+                Connector._add(before, totals)
+                if is_dir:
+                    deleted_dirs.append(name)
+
+        if deleted:
+            cache.delete_items(deleted)
+            self._update_totals(path, before, (0, 0), started)
+        if deleted_dirs:
+            self._tree_index().remove_many(path, deleted_dirs)
+            return Connector._output(0, self._get_folder_content(target_dir), self._get_tree(), items=items)
+        return Connector._output(0, self._get_folder_content(target_dir), items=items)
 
-            if not re.match('^[a-z0-9-_.]+$', os.path.basename(copy_target_dir)):
-                return Connector._output(self.ERR_INVALID_PARAMETER)
+    @staticmethod
+    def _add(totals, values):
+        totals[0] += values[0]
+        totals[1] += values[1]
 
-            try:
-                shutil.copyfile(target, copy_target_dir)
-            except IOError:
-                return Connector._output(self.ERR_COPY)
+    @staticmethod
+    def _item_status(name, err):
+        ret = {'name': name, 'status': ('OK' if err == 0 else 'ERR')}
+        if err > 0:
+            ret['err'] = err
+        return ret
 
-            cache = CacheDir(os.path.dirname(copy_target_dir), self._config)
-            cache.update_item(os.path.basename(copy_target_dir))
-            return Connector._output(0)
+    def copy(self, path, name, new_target):
+        """ copy file or folder to another folder
+        :param path: relative path
+        :param name: file or folder to copy
+        :param new_target: target folder or file
+        """
+        return self._transfer(path, name, new_target, False)
 
     def move(self, path, name, new_target):
-        """ move file to another folder
+        """ move file or folder to another folder
         :param path: relative path
-        :param name: file to move
+        :param name: file or folder to move
         :param new_target: target folder or file
         """
+        return self._transfer(path, name, new_target, True)
+
+    def _transfer(self, path, name, new_target, is_move):
         target_dir = self._target_dir(path)
         target = target_dir + '/' + name
-        if isdir(target):
-            return Connector._output(self.ERR_INVALID_PARAMETER)
-        if not isfile(target):
+        if not name or not os.path.exists(target):
             return Connector._output(self.ERR_FILE_NOT_FOUND)
 
         copy_target_dir = self._target_dir('') + new_target
 
         if isdir(copy_target_dir):
-            try:
-                shutil.move(target, copy_target_dir + '/' + name)
-            except IOError:
-                return Connector._output(self.ERR_COPY)
-
-            cache = CacheDir(copy_target_dir, self._config)
-            cache.update_item(name)
+            new_path = new_target
+            new_name = name
         else:
             if isfile(copy_target_dir):
                 return Connector._output(self.ERR_COPY_FILE_EXISTS)
@@ -341,69 +749,411 @@ class Connector:
             if not re.match('^[a-z0-9-_.]+$', os.path.basename(copy_target_dir)):
                 return Connector._output(self.ERR_INVALID_PARAMETER)
 
-            try:
-                os.rename(target, copy_target_dir)
-            except IOError:
-                return Connector._output(self.ERR_COPY)
+            new_path = os.path.dirname(new_target)
+            new_name = os.path.basename(copy_target_dir)
+            copy_target_dir = os.path.dirname(copy_target_dir)
+
+        # caches are loaded before changes on disk, otherwise changed directories would be scanned again
+        is_dir = isdir(target)
+        source_cache = CacheDir(target_dir, self._config) if is_move else None
+        target_cache = CacheDir(copy_target_dir, self._config)
+        started = time.time()
+        source_totals = Connector._file_totals(target)
+        before = Connector._file_totals(copy_target_dir + '/' + new_name)
+        err = self._transfer_item(target, copy_target_dir + '/' + new_name, is_move)
+        if err > 0:
+            return Connector._output(err)
+
+        if is_move:
+            self._move_thumbnails(source_cache, name, target_cache.path(), new_name)
+        target_cache.update_item(new_name)
+        self._update_totals(new_path, before, Connector._file_totals(copy_target_dir + '/' + new_name), started)
+        if is_move:
+            self._update_totals(path, source_totals, (0, 0), started)
+        if is_dir and is_move:
+            self._tree_index().move(path, name, new_path, new_name)
+        elif is_dir:
+            self._tree_index().copy(path, name, new_path, new_name)
+        if not is_move:
+            return Connector._output(0, tree=(self._get_tree() if is_dir else None))
+
+        source_cache.delete_item(name)
+        return Connector._output(0, self._get_folder_content(target_dir), self._get_tree() if is_dir else None)
+
+    def _move_thumbnails(self, cache, name, new_path, new_name):
+        """ rename stored thumbnails of moved file or of images in moved folder, keys of thumbnails contain
+        relative path of image. Folders are known from tree, their caches were moved to new path already
+        :param cache: instance of CacheDir of source folder loaded before move
+        :param name: original name of file or folder
+        :param new_path: relative path of target folder with trailing slash
+        :param new_name: new name of file or folder
+        """
+        item = cache.get_item(name)
+        if item is None:
+            return
+        store = ThumbnailStore(self._config.base_dir)
+        if item.type != 'dir':
+            key = item.thumbnail_key(self._config, cache.path())
+            if key is not None:
+                store.move(key, item.replace(name=new_name).thumbnail_key(self._config, new_path))
+            return
+        backend = get_backend(self._config)
+        path = cache.path() + name + '/'
+        new_path += new_name + '/'
+        for folder in self._tree_index().paths(path):
+            new_folder = new_path + folder[len(path):]
+            for record in (backend.load(self._target_dir(new_folder)) or {}).values():
+                key = record.thumbnail_key(self._config, folder)
+                if key is not None:
+                    store.move(key, record.thumbnail_key(self._config, new_folder))
+
+    def _transfer_item(self, source, target, is_move):
+        """ copy or move file or folder, returns error code or 0. Folders are moved by single rename,
+        copied files are not read into memory
+
+        :param source: full path to file or folder
+        :param target: full path to new file or folder
+        :param is_move: True for move, False for copy
+        """
+        real_source = os.path.realpath(source)
+        real_target = os.path.realpath(target)
+        if real_target == real_source:
+            return self.ERR_COPY_FILE_EXISTS
+        is_dir = isdir(source)
+        if is_dir:
+            if real_target.startswith(real_source + os.sep):
+                return self.ERR_INVALID_PARAMETER
+            if os.path.exists(target):
+                return self.ERR_COPY_FILE_EXISTS
+        elif not isfile(source):
+            return self.ERR_FILE_NOT_FOUND
+        elif isdir(target):
+            return self.ERR_COPY_FILE_EXISTS
 
-            cache = CacheDir(os.path.dirname(copy_target_dir), self._config)
-            cache.update_item(os.path.basename(copy_target_dir))
+        try:
+            if is_move:
+                move_tree(source, target, self._config.mode_dir)
+                if is_dir:
+                    get_backend(self._config).move(source + '/', target + '/')
+            elif is_dir:
+                copy_tree(source, target, self._config.mode_dir)
+            else:
+                copy_file(source, target)
+        except (IOError, OSError):
+            if is_dir and not is_move:
+                shutil.rmtree(target, ignore_errors=True)
+            return self.ERR_COPY
+        return 0
+
+    def copy_many(self, path, names, new_target):
+        """ copy files and folders to another folder, cache of target folder and tree are updated once
+        for all of them. Returns property "items" with status of each name
 
-        cache = CacheDir(target_dir, self._config)
-        cache.delete_item(name)
+        :param path: relative path
+        :param names: list of files and folders to copy
+        :param new_target: target folder
+        """
+        return self._transfer_many(path, names, new_target, False)
 
-        return Connector._output(0, self._get_folder_content(target_dir))
+    def move_many(self, path, names, new_target):
+        """ move files and folders to another folder, caches of both folders and tree are updated once
+        for all of them. Returns property "items" with status of each name and property "files"
+
+        :param path: relative path
+        :param names: list of files and folders to move
+        :param new_target: target folder
+        """
+        return self._transfer_many(path, names, new_target, True)
+
+    def _transfer_many(self, path, names, new_target, is_move):
+        target_dir = self._target_dir(path)
+        if not os.path.isdir(target_dir):
+            return Connector._output(self.ERR_DIRECTORY_NOT_FOUND)
+        copy_target_dir = self._target_dir('') + new_target
+        if not os.path.isdir(copy_target_dir):
+            return Connector._output(self.ERR_COPY_DIR_NOT_FOUND)
+
+        # caches are loaded before changes on disk, otherwise changed directories would be scanned again
+        source_cache = CacheDir(target_dir, self._config) if is_move else None
+        target_cache = CacheDir(copy_target_dir, self._config)
+        items = []
+        done = []
+        done_dirs = []
+        moved = [0, 0]
+        before = [0, 0]
+        after = [0, 0]
+        started = time.time()
+        for name in names:
+            target = target_dir + '/' + name
+            is_dir = isdir(target)
+            source_totals = Connector._file_totals(target)
+            target_totals = Connector._file_totals(copy_target_dir + '/' + name)
+            if name:
+                err = self._transfer_item(target, copy_target_dir + '/' + name, is_move)
+            else:
+                err = self.ERR_INVALID_PARAMETER
+            items.append(Connector._item_status(name, err))
+            if err == 0:
+                done.append(name)
+                if is_move:
+                    self._move_thumbnails(source_cache, name, target_cache.path(), name)
+                Connector._add(moved, source_totals)
+                Connector._add(before, target_totals)
+                Connector._add(after, Connector._file_totals(copy_target_dir + '/' + name))
+                if is_dir:
+                    done_dirs.append(name)
+
+        if done:
+            target_cache.update_items(done)
+            self._update_totals(new_target, before, after, started)
+            if is_move:
+                self._update_totals(path, moved, (0, 0), started)
+        if done_dirs and is_move:
+            self._tree_index().move_many(path, done_dirs, new_target)
+        elif done_dirs:
+            self._tree_index().copy_many(path, done_dirs, new_target)
+        tree = self._get_tree() if done_dirs else None
+        if not is_move:
+            return Connector._output(0, tree=tree, items=items)
+        if done:
+            source_cache.delete_items(done)
+        return Connector._output(0, self._get_folder_content(target_dir), tree, items=items)
 
 
 class CacheDir:
     """ manipulate  with cached content of directory """
 
-    CACHE_FILENAME = '.htdircache'
+    CACHE_FILENAME = JsonFileBackend.CACHE_FILENAME
+
+    SORT_KEYS = {
+        'name': lambda item: item.name.lower(),
+        'date': lambda item: (item.mtime, item.name.lower()),
+        'size': lambda item: (item.size or 0, item.name.lower())
+    }
+
+    _thread_locks = {}
+    _thread_locks_lock = threading.Lock()
 
     def __init__(self, cache_directory, config):
         self._dir = cache_directory.rstrip('/') + '/'
         self._config = config
-        self._cachefile = self._dir + self.CACHE_FILENAME
-        if os.path.isfile(self._cachefile) and os.path.getmtime(self._cachefile) > time.time() - 7200:
-            with open(self._cachefile) as data_file:
-                try:
-                    self._items = json.load(data_file)
-                except ValueError:
-                    self.refresh()
-        else:
+        self._backend = get_backend(config)
+        self._key = os.path.abspath(self._dir)
+        self._path = relative_path(config.base_dir, self._dir)
+        self._items = {}
+        self._token = None
+        saved = self._reload()
+        if saved is None or not self._is_fresh(saved):
             self.refresh()
 
-    def get_files(self):
-        """ returns array of folders and files in cache """
-        return self._items.values()
+    def _reload(self):
+        """ load items saved by any process, returns time of last save, None if there is no usable cache """
+        version = self._backend.version(self._dir)
+        if version is None:
+            return None
+
+        listings = ListingCache.shared()
+        items = listings.get(self._key, version[0])
+        if items is None:
+            with timer('cache_load'):
+                items = self._backend.load(self._dir)
+            if items is None:
+                return None
+            listings.put(self._key, version[0], items)
+        self._items = items
+        self._token = version[0]
+        return version[1]
+
+    @contextmanager
+    def _locked(self):
+        """ exclusive read-modify-write of cache between threads and processes, items are reloaded.
+        lockf is not inherited by processes forked meanwhile (i.e. thumbnail workers), but it
+        does not exclude threads of one process
+        """
+        with CacheDir._thread_lock(self._key):
+            with open(self._backend.lock_filename(self._dir), 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.lockf(lock_file, fcntl.LOCK_EX)
+                self._reload()
+                yield
+
+    @staticmethod
+    def _thread_lock(key):
+        with CacheDir._thread_locks_lock:
+            if key not in CacheDir._thread_locks:
+                CacheDir._thread_locks[key] = threading.Lock()
+            return CacheDir._thread_locks[key]
+
+    @staticmethod
+    def remove(cache_directory, config):
+        """ delete cache of directory
+        :param cache_directory: full path to directory
+        :param config: instance of Config
+        """
+        cache_directory = cache_directory.rstrip('/') + '/'
+        get_backend(config).remove(cache_directory)
+        ListingCache.shared().discard(os.path.abspath(cache_directory))
+
+    @staticmethod
+    def is_stale(cache_directory, config):
+        """ returns True if directory is not cached or its cache is refreshed on next use
+        :param cache_directory: full path to directory
+        :param config: instance of Config
+        """
+        cache_directory = cache_directory.rstrip('/') + '/'
+        version = get_backend(config).version(cache_directory)
+        return version is None or not CacheDir._is_fresh_since(cache_directory, version[1], config.cache_ttl)
+
+    def _is_fresh(self, saved):
+        return CacheDir._is_fresh_since(self._dir, saved, self._config.cache_ttl)
+
+    @staticmethod
+    def _is_fresh_since(cache_directory, saved, ttl):
+        """ cache is fresh until TTL expires or until directory is changed by someone else,
+        changed content of file does not change mtime of directory, it is found after TTL
+        :param cache_directory: full path to directory with trailing slash
+        :param saved: time of last save of cache
+        :param ttl: max. age of cache in seconds
+        """
+        if saved <= time.time() - ttl:
+            return False
+        return os.path.getmtime(cache_directory) <= saved
+
+    def get_files(self, sort='name', reverse=False):
+        """ returns list of folders and files in cache, folders first
+        :param sort: 'name', 'date' or 'size'
+        :param reverse: True for descending order
+        """
+        self._update_pending()
+        return [self._items[name] for name in self._sorted_names(sort, reverse)]
+
+    def version(self):
+        """ returns token which changes with each save of cache, finished thumbnails are saved first """
+        self._update_pending()
+        return self._token
+
+    def path(self):
+        """ returns relative path of directory with trailing slash, empty for base dir """
+        return self._path
+
+    def get_item(self, item_name):
+        """ returns cached folder or file, None if it is not cached
+        :param item_name: name of file or folder
+        """
+        return self._items.get(item_name)
+
+    def _sorted_names(self, sort, reverse):
+        """ sorted names are kept in process cache until content of directory changes """
+        listings = ListingCache.shared()
+        names = listings.get_order(self._key, self._token, (sort, reverse))
+        if names is None:
+            key = self.SORT_KEYS[sort]
+            dirs = sorted((name for name, item in self._items.items() if item.type == 'dir'),
+                          key=lambda name: key(self._items[name]), reverse=reverse)
+            files = sorted((name for name, item in self._items.items() if item.type != 'dir'),
+                           key=lambda name: key(self._items[name]), reverse=reverse)
+            names = dirs + files
+            listings.put_order(self._key, self._token, (sort, reverse), names)
+        return names
+
+    def _update_pending(self):
+        """ pick up thumbnails finished by background workers """
+        if not any(item.thumb == Record.THUMB_PENDING for item in self._items.values()):
+            return
+
+        with self._locked():
+            changed = []
+            for name, item in self._items.items():
+                if item.thumb != Record.THUMB_PENDING or not os.path.isfile(self._dir + name):
+                    continue
+                file_info = File(self._dir + name, self._config)
+                try:
+                    thumb = file_info.thumbnail_state()
+                    if thumb != Record.THUMB_PENDING:
+                        self._items[name] = item.replace(thumb=thumb, meta=file_info.metadata())
+                        changed.append(name)
+                finally:
+                    file_info.close()
+            if changed:
+                self._save(changed)
 
     def refresh(self):
-        """ refresh entire cache """
-        result = {}
-        for filename in glob.glob(self._dir + '*'):
-            file_info = File(filename, self._config)
-            result[os.path.basename(os.path.normpath(filename))] = file_info.get_params()
-        self._items = result
-        self._save()
+        """ refresh cache, only new files and files with changed mtime or size are read again """
+        with self._locked(), timer('cache_refresh'):
+            result = {}
+            for entry in scandir(self._dir):
+                if entry.name.startswith('.'):
+                    continue
+                try:
+                    stat = entry.stat()
+                    size = None if entry.is_dir() else stat.st_size
+                    item = self._items.get(entry.name)
+                    if item is None or item.mtime != stat.st_mtime or item.size != size:
+                        if item is not None:
+                            self._delete_thumbnail(item)
+                        item = File(self._dir + entry.name, self._config).get_record()
+                except OSError:
+                    # deleted by another process during scan
+                    continue
+                result[entry.name] = item
+            count('refresh_entries', len(result))
+            for name, item in self._items.items():
+                if name not in result:
+                    self._delete_thumbnail(item)
+            self._items = result
+            self._save()
 
     def update_item(self, item_name):
         """ add or update file or directory in cache
         :param item_name: name of file or folder
         """
-        file_info = File(self._dir + item_name, self._config)
-        self._items[os.path.basename(os.path.normpath(item_name))] = file_info.get_params()
-        self._save()
+        self.update_items([item_name])
+
+    def update_items(self, item_names):
+        """ add or update files or directories in cache with one write
+        :param item_names: list of names of files or folders
+        """
+        items = {}
+        for item_name in item_names:
+            file_info = File(self._dir + item_name, self._config)
+            items[os.path.basename(os.path.normpath(item_name))] = file_info.get_record()
+        with self._locked():
+            for name, item in items.items():
+                old = self._items.get(name)
+                if old is not None and old.thumbnail_key(self._config, self._path) != \
+                        item.thumbnail_key(self._config, self._path):
+                    self._delete_thumbnail(old)
+                self._items[name] = item
+            self._save(items.keys())
 
     def delete_item(self, item_name):
         """ delete file or directory in cache
         :param item_name: name of file or folder
         """
-        self._items.pop(os.path.basename(os.path.normpath(item_name)), None)
-        self._save()
+        self.delete_items([item_name])
 
-    def _save(self):
-        with open(self._cachefile, mode='w') as cache_file:
-            json.dump(self._items, cache_file, ensure_ascii=False)
+    def delete_items(self, item_names):
+        """ delete files or directories in cache with one write
+        :param item_names: list of names of files or folders
+        """
+        names = [os.path.basename(os.path.normpath(item_name)) for item_name in item_names]
+        with self._locked():
+            for name in names:
+                old = self._items.pop(name, None)
+                if old is not None:
+                    self._delete_thumbnail(old)
+            self._save([], names)
+
+    def _delete_thumbnail(self, item):
+        key = item.thumbnail_key(self._config, self._path)
+        if key is not None:
+            ThumbnailStore(self._config.base_dir).delete(key)
+
+    def _save(self, changed=None, deleted=None):
+        with timer('cache_save'):
+            self._backend.save(self._dir, self._items, changed, deleted)
+        self._token = self._backend.version(self._dir)[0]
+        ListingCache.shared().put(self._key, self._token, self._items)
 
 
 class File:
@@ -412,26 +1162,82 @@ class File:
     def __init__(self, filename, config):
         self._file = filename
         self._config = config
-
-    def get_params(self):
+        self._image = None
+        self._header = None
+        self._pixels = None
+        self._mime = False
+        self._data_file = None
+
+    def _folder_path(self):
+        return relative_path(self._config.base_dir, os.path.dirname(self._file))
+
+    def get_record(self):
+        """ return info about file or folder as Record, thumbnail is generated if file is image """
+        count('file_reads')
+        stat = os.stat(self._file)
+        filetype = self._filetype()
+        try:
+            image_size = self._image_size()
+            # header is read before thumbnail decodes the image
+            self._header_metadata()
+            thumb = self.thumbnail_state()
+        finally:
+            self.close()
+        return Record(os.path.basename(self._file), filetype, stat.st_size if filetype == 'file' else None,
+                      stat.st_mtime, *(image_size or (None, None)), thumb=thumb, meta=self.metadata(),
+                      mime=self.mime())
+
+    def mime(self):
+        """ returns mime type detected by first bytes of file, None for directory. File of image is kept
+        open for PIL until close()
         """
-        return info about file or folder as dictionary with keys:
-        'name' - name of file or folder
-        'type' - 'file' or 'dir'
-        'size' - filesize in bytes, None for directory
-        'date' - date of file in format ISO8601
-        'imgsize' - list with width and height if file is image, otherwise None
-        'thumbnail' - thumbnail of image as base64 data uri
+        if self._mime is False:
+            self._mime = None
+            if os.path.isfile(self._file):
+                with timer('mime_sniff'):
+                    try:
+                        data_file = open(self._file, 'rb')
+                    except IOError:
+                        return None
+                    try:
+                        self._mime = sniff(self._file, data_file.read(HEAD_SIZE))
+                    except IOError:
+                        self._mime = None
+                    if is_raster(self._mime):
+                        self._data_file = data_file
+                    else:
+                        data_file.close()
+        return self._mime
+
+    def close(self):
+        """ close file kept open for image """
+        self._image = None
+        if self._data_file is not None:
+            self._data_file.close()
+            self._data_file = None
+
+    def metadata(self):
+        """ returns dictionary with metadata of image read by extractors from header and from pixels of
+        thumbnail, None if file is not an image or nothing was read
         """
-
-        return {
-            'name': os.path.basename(self._file),
-            'type': self._filetype(),
-            'size': (os.path.getsize(self._file) if os.path.isfile(self._file) else None),
-            'date': self._date(),
-            'imgsize': self._image_size(),
-            'thumbnail': self._thumbnail()
-        }
+        meta = dict(self._header_metadata(), **(self._pixels or {}))
+        return meta or None
+
+    def _header_metadata(self):
+        if self._header is None:
+            im = self._open_image() if self._is_image() else None
+            with timer('image_metadata'):
+                self._header = read_header(im) if im else {}
+        return self._header
+
+    def thumbnail_state(self):
+        """ returns state of thumbnail as one of Record.THUMB_* constants """
+        thumbnail = self.thumbnail()
+        if thumbnail is ThumbnailQueue.PENDING:
+            return Record.THUMB_PENDING
+        if thumbnail == '':
+            return Record.THUMB_NONE
+        return Record.THUMB_READY if thumbnail else Record.THUMB_FAILED
 
     def _filetype(self):
         if os.path.isfile(self._file):
@@ -441,41 +1247,75 @@ class File:
         else:
             return 'unknown'
 
-    def _date(self):
-        date = os.path.getmtime(self._file)
-        return datetime.fromtimestamp(date, pytz.UTC).isoformat()
+    def _is_image(self):
+        return is_raster(self.mime())
 
-    def _image_size(self):
-        if not os.path.isfile(self._file):
-            return None
-        ext = os.path.splitext(self._file)[1][1:].strip().lower()
-        if ext != 'jpg' and ext != 'jpeg' and ext != 'gif' and ext != 'png':
-            return None
+    def _open_image(self):
+        """ open image once for size and thumbnail, PIL reads only header until pixels are needed.
+        PIL reads file opened by mime(), file is not opened again
+        """
+        if self._image is None:
+            try:
+                if self._data_file is not None:
+                    self._data_file.seek(0)
+                    self._image = Image.open(self._data_file)
+                else:
+                    self._image = Image.open(self._file)
+            except IOError:
+                self._image = False
+        return self._image
 
-        try:
-            im = Image.open(self._file)
-        except IOError:
+    def _image_size(self):
+        if not self._is_image():
             return None
 
-        return im.size
+        with timer('image_size'):
+            im = self._open_image()
+            return im.size if im else None
 
-    def _thumbnail(self):
-        if not os.path.isfile(self._file):
-            return ''
-        ext = os.path.splitext(self._file)[1][1:].strip().lower()
-        if ext != 'jpg' and ext != 'jpeg' and ext != 'gif' and ext != 'png':
+    def thumbnail(self):
+        """ returns key of thumbnail in ThumbnailStore, ThumbnailQueue.PENDING if thumbnail is generated
+        in background
+        """
+        if not self._is_image():
             return ''
 
-        try:
-            im = Image.open(self._file)
-        except IOError:
+        width = self._config.thumb_max_width
+        height = self._config.thumb_max_height
+        store = ThumbnailStore(self._config.base_dir)
+        stat = os.stat(self._file)
+        key = store.key(self._folder_path(), os.path.basename(self._file), stat.st_mtime, stat.st_size, width,
+                        height)
+        if store.exists(key):
+            if self._pixels is None:
+                self._pixels = File._stored_pixels(store.filename(key))
+            return key
+
+        if self._config.thumb_workers > 0:
+            queue = ThumbnailQueue.get(self._config)
+            saved = queue.thumbnail(self._file, store.filename(key), width, height)
+        else:
+            with timer('thumbnail_render'):
+                im = self._open_image()
+                saved = render_thumbnail(im, store.filename(key), width, height,
+                                         self._header_metadata().get('orientation', 1)) if im else None
+            count('thumbnails_rendered')
+            # image was decoded in reduced size, it cannot be used again
+            self._image = None
+        if saved is ThumbnailQueue.PENDING:
+            return saved
+        if saved is None:
             return None
+        self._pixels = saved
+        return key
 
-        im.thumbnail([100, 100], Image.ANTIALIAS)
-
-        string_file = StringIO()
-        im.save(string_file, 'JPEG', quality=90)
-        return 'data:image/jpeg;base64,' + base64.encodestring(string_file.getvalue())
+    @staticmethod
+    def _stored_pixels(filename):
+        """ returns metadata read from pixels of thumbnail rendered earlier, i.e. by another process """
+        try:
+            return read_pixels(Image.open(filename))
+        except IOError:
+            return {}
 
     @staticmethod
     def remove_accents(input_str):
@@ -0,0 +1,104 @@
+"""
+prewarm prewarm
+
+Builds caches of all directories of one root and thumbnails of their images in parallel processes,
+so the first request of each folder does not scan it.
+
+"""
+from multiprocessing import Pool
+import os
+import time
+
+from connector.models import CacheDir
+from connector.tree import TreeIndex
+from connector.utils import state_dir
+
+STATE_FILENAME = 'prewarm'
+
+
+def prewarm(config, workers=2, incremental=False, max_depth=None, restart=False, progress=None):
+    """ build caches of directories, returns dictionary with number of 'directories', 'files' and
+    'skipped' directories, list of 'errors' and 'seconds' of run. Finished directories are written to
+    state file in folder of connector, interrupted run continues with remaining directories
+
+    :param config: instance of Config
+    :param workers: number of processes, 0 builds caches in current process
+    :param incremental: True builds only directories with missing or stale cache, otherwise caches are
+        rebuilt from scratch
+    :param max_depth: max. level of nested folders, 0 for root only, None for unlimited
+    :param restart: True ignores state of interrupted run
+    :param progress: optional function called with relative path and number of files after each directory
+    """
+    start = time.time()
+    tree = TreeIndex(config)
+    tree.rebuild()
+    state_file = state_dir(config.base_dir, create=True) + STATE_FILENAME
+    done = set() if restart else _load_state(state_file)
+
+    paths = []
+    skipped = 0
+    for path in sorted(_encode(path) for path in tree.paths()):
+        if max_depth is not None and len(TreeIndex.split_path(path)) > max_depth:
+            continue
+        if path in done or (incremental and not CacheDir.is_stale(config.base_dir + path, config)):
+            skipped += 1
+            continue
+        paths.append(path)
+
+    # thumbnails are generated in worker itself, not in another pool
+    worker_config = config.replace(thumb_workers=0)
+    jobs = [(worker_config, path, not incremental) for path in paths]
+    result = {'directories': 0, 'files': 0, 'skipped': skipped, 'errors': []}
+    pool = Pool(workers) if workers > 0 else None
+    try:
+        results = pool.imap_unordered(_warm_directory, jobs) if pool else (_warm_directory(job) for job in jobs)
+        with open(state_file, 'w' if restart else 'a') as state:
+            for path, files, error in results:
+                if error is not None:
+                    result['errors'].append((path, error))
+                    continue
+                state.write(path + '\n')
+                state.flush()
+                result['directories'] += 1
+                result['files'] += files
+                if progress is not None:
+                    progress(path, files)
+        if pool:
+            pool.close()
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    if not result['errors']:
+        os.unlink(state_file)
+    result['seconds'] = time.time() - start
+    return result
+
+
+def _load_state(state_file):
+    """ returns set of directories finished by interrupted run """
+    try:
+        with open(state_file) as state:
+            return set(line.rstrip('\n') for line in state)
+    except IOError:
+        return set()
+
+
+def _encode(path):
+    return path.encode('utf-8') if isinstance(path, unicode) else path
+
+
+def _warm_directory(job):
+    """ build cache of directory, returns tuple (relative path, number of files, error or None)
+    :param job: tuple (config, relative path, True to rebuild existing cache)
+    """
+    config, path, rebuild = job
+    directory = config.base_dir + path
+    try:
+        if rebuild:
+            CacheDir.remove(directory, config)
+        cache = CacheDir(directory, config)
+        return path, len(cache.get_files()), None
+    except (IOError, OSError) as e:
+        return path, 0, str(e)
@@ -0,0 +1,120 @@
+"""
+records Record
+
+"""
+from datetime import datetime
+
+import pytz
+
+from connector.thumbnails import ThumbnailStore
+
+
+class Record(object):
+    """ compact cached info about file or folder, only raw values are kept in memory and in cache,
+    values returned to client are formatted by format()
+    """
+
+    __slots__ = ('name', 'type', 'size', 'mtime', 'width', 'height', 'thumb', 'meta', 'mime')
+
+    THUMB_NONE = 0
+    THUMB_READY = 1
+    THUMB_PENDING = 2
+    THUMB_FAILED = 3
+
+    # loaded records share one string of each type
+    TYPES = dict((filetype, filetype) for filetype in ('file', 'dir', 'unknown'))
+    # loaded records share one string of each mime type
+    MIMES = {}
+
+    def __init__(self, name, filetype, size, mtime, width=None, height=None, thumb=THUMB_NONE, meta=None,
+                 mime=None):
+        """
+        :param name: name of file or folder
+        :param filetype: 'file', 'dir' or 'unknown'
+        :param size: filesize in bytes, None for directory
+        :param mtime: modification time as timestamp
+        :param width: width of image, None if file is not an image
+        :param height: height of image, None if file is not an image
+        :param thumb: state of thumbnail, one of THUMB_* constants
+        :param meta: dictionary with metadata of image read by extractors, None if nothing was read
+        :param mime: mime type of file detected by content, None for directory
+        """
+        self.name = name
+        self.type = self.TYPES.get(filetype, filetype)
+        self.size = size
+        self.mtime = mtime
+        self.width = width
+        self.height = height
+        self.thumb = thumb
+        self.meta = meta
+        self.mime = None if mime is None else self.MIMES.setdefault(mime, mime)
+
+    def pack(self):
+        """ returns list of values stored in cache, name is stored as key """
+        return [self.type, self.size, self.mtime, self.width, self.height, self.thumb, self.meta, self.mime]
+
+    @classmethod
+    def unpack(cls, name, data):
+        """ returns record from values stored in cache
+        :param name: name of file or folder
+        :param data: list returned by pack()
+        """
+        return cls(name, *data)
+
+    def replace(self, **values):
+        """ returns copy of record with changed values, records are shared by caches so they are never
+        changed in place
+        :param values: changed attributes
+        """
+        record = Record(self.name, self.type, self.size, self.mtime, self.width, self.height, self.thumb, self.meta,
+                        self.mime)
+        for name, value in values.items():
+            setattr(record, name, value)
+        return record
+
+    def thumbnail_key(self, config, path):
+        """ returns key of thumbnail in ThumbnailStore, None if thumbnail is not ready
+        :param config: instance of Config
+        :param path: relative path of folder of file with trailing slash, empty for base dir
+        """
+        if self.thumb != self.THUMB_READY:
+            return None
+        return ThumbnailStore.key(path, self.name, self.mtime, self.size, config.thumb_max_width,
+                                  config.thumb_max_height)
+
+    def format(self, config, path):
+        """
+        returns info about file or folder as dictionary for JSON with keys:
+        'name' - name of file or folder
+        'type' - 'file' or 'dir'
+        'mime' - mime type of file detected by content, None for directory
+        'size' - filesize in bytes, None for directory
+        'date' - date of file in format ISO8601
+        'mtime' - modification time as timestamp
+        'imgsize' - list with width and height if file is image, otherwise None
+        'thumbnail' - url of thumbnail, empty if file is not an image, None if thumbnail failed
+        'thumbnail_pending' - True if thumbnail is still generated in background
+        'meta' - dictionary with metadata of image, i.e. 'orientation' and 'taken' from EXIF, 'blurhash' and
+            'color' of thumbnail, None if nothing is known
+
+        :param config: instance of Config
+        :param path: relative path of folder of file with trailing slash, empty for base dir
+        """
+        if self.thumb == self.THUMB_READY:
+            thumbnail = config.thumb_url + '&key=' + self.thumbnail_key(config, path)
+        elif self.thumb == self.THUMB_FAILED:
+            thumbnail = None
+        else:
+            thumbnail = ''
+        return {
+            'name': self.name,
+            'type': self.type,
+            'mime': self.mime,
+            'size': self.size,
+            'date': datetime.fromtimestamp(self.mtime, pytz.UTC).isoformat(),
+            'mtime': self.mtime,
+            'imgsize': None if self.width is None else [self.width, self.height],
+            'thumbnail': thumbnail,
+            'thumbnail_pending': self.thumb == self.THUMB_PENDING,
+            'meta': self.meta
+        }
@@ -0,0 +1,69 @@
+"""
+registry ConfigRegistry
+
+Named configs resolved from GSTBROWSER_* settings once, requests get frozen configs and shared connectors
+by dictionary lookup.
+
+"""
+from urllib import urlencode
+
+from connector.models import Config, Connector
+
+# settings with one value per config, name of setting is GSTBROWSER_ + attribute of Config in upper case
+SETTINGS = ('mode_dir', 'mode_file', 'thumb_max_width', 'thumb_max_height', 'thumb_workers', 'thumb_queue_size',
+            'thumb_timeout', 'cache_ttl', 'tree_ttl', 'cache_backend', 'max_upload_size', 'stream_responses',
+            'cache_control')
+
+
+class ConfigRegistry(object):
+    """ frozen configs of all roots in settings and connectors shared by requests """
+
+    DEFAULT = 'default'
+
+    def __init__(self, settings):
+        """
+        :param settings: django settings or module with GSTBROWSER_* dictionaries
+        """
+        self._configs = dict((name, ConfigRegistry._build(settings, name)) for name in settings.GSTBROWSER_ROOT_DIR)
+        self._connectors = {}
+
+    @staticmethod
+    def _build(settings, name):
+        """ returns frozen config of name, missing values are taken from default config """
+        config = Config(settings.GSTBROWSER_ROOT_DIR[name])
+        for attribute in SETTINGS:
+            values = getattr(settings, 'GSTBROWSER_' + attribute.upper(), {})
+            if name in values:
+                setattr(config, attribute, values[name])
+            elif ConfigRegistry.DEFAULT in values:
+                setattr(config, attribute, values[ConfigRegistry.DEFAULT])
+        return config.freeze()
+
+    def names(self):
+        """ returns sorted names of configs """
+        return sorted(self._configs)
+
+    def __contains__(self, name):
+        return name in self._configs
+
+    def get(self, name):
+        """ returns frozen config, unknown name returns default config
+        :param name: name of config
+        """
+        return self._configs.get(name) or self._configs[self.DEFAULT]
+
+    def connector(self, name, url):
+        """ returns connector shared by all requests of config, its thumbnails are served by url
+        :param name: name of config, unknown name returns connector of default config
+        :param url: path of connector view
+        """
+        if name not in self._configs:
+            name = self.DEFAULT
+        key = (name, url)
+        connector = self._connectors.get(key)
+        if connector is None:
+            thumb_url = url + '?' + urlencode({'config': name, 'action': 'thumb'})
+            connector = Connector(self._configs[name].replace(thumb_url=thumb_url))
+            # concurrent requests may create the same connector, either of them is kept
+            connector = self._connectors.setdefault(key, connector)
+        return connector
@@ -0,0 +1,138 @@
+"""
+search NameQuery, NameIndex
+
+"""
+import fnmatch
+import os
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+
+class NameQuery(object):
+    """ case insensitive query on names of files """
+
+    MODES = ('substring', 'glob', 'ext')
+
+    def __init__(self, query, mode='substring'):
+        """
+        :param query: searched text, glob pattern or comma separated extensions without dot
+        :param mode: 'substring', 'glob' or 'ext'
+        """
+        self.query = query.lower()
+        self.mode = mode
+        self._extensions = [ext.strip().lstrip('.') for ext in self.query.split(',') if ext.strip()]
+
+    def is_valid(self):
+        """ returns False for unknown mode or empty query """
+        if self.mode not in self.MODES or self.query == '':
+            return False
+        return self.mode != 'ext' or bool(self._extensions)
+
+    def match(self, name):
+        """ returns True if name matches query
+        :param name: name of file or folder
+        """
+        name = name.lower()
+        if self.mode == 'glob':
+            return fnmatch.fnmatchcase(name, self.query)
+        if self.mode == 'ext':
+            return os.path.splitext(name)[1][1:] in self._extensions
+        return self.query in name
+
+    def sql(self, column):
+        """ returns tuple (sql condition, parameters) for sqlite
+        :param column: name of column with name of file
+        """
+        if self.mode == 'glob':
+            return 'lower(%s) GLOB ?' % column, (self.query,)
+        if self.mode == 'ext':
+            condition = ' OR '.join(['lower(%s) GLOB ?' % column] * len(self._extensions))
+            return '(' + condition + ')', tuple('*.' + ext for ext in self._extensions)
+        return 'instr(lower(%s), ?) > 0' % column, (self.query,)
+
+
+class NameIndex(object):
+    """ in-process index of names of files in directory caches of one root. Names of directory are
+    read again when version of its cache changes, i.e. after any mutating action in any process. Names of
+    directories without cache are listed from disk until mtime of directory changes
+    """
+
+    _indexes = {}
+    _indexes_lock = threading.Lock()
+
+    def __init__(self):
+        self._dirs = {}
+        self._listed = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, base_dir):
+        """ returns index shared by all requests with the same base dir
+        :param base_dir: full path to root directory
+        """
+        base_dir = os.path.abspath(base_dir)
+        with cls._indexes_lock:
+            if base_dir not in cls._indexes:
+                cls._indexes[base_dir] = cls()
+            return cls._indexes[base_dir]
+
+    def search(self, backend, directories, query):
+        """ returns list of tuples (directory, name) matching query
+        :param backend: instance of CacheBackend
+        :param directories: dictionary relative path -> full path of searched directories
+        :param query: instance of NameQuery
+        """
+        result = []
+        with self._lock:
+            for relative in sorted(directories):
+                for name in self._names(backend, relative, directories[relative]):
+                    if query.match(name):
+                        result.append((relative, name))
+            for relative in set(self._dirs) - set(directories):
+                del self._dirs[relative]
+        return result
+
+    def search_listed(self, directories, query):
+        """ returns list of tuples (directory, name) matching query in directories which are not cached,
+        names are read by scandir, records of files are not built
+        :param directories: dictionary relative path -> full path of searched directories
+        :param query: instance of NameQuery
+        """
+        result = []
+        with self._lock:
+            for relative in sorted(directories):
+                for name in self._listed_names(relative, directories[relative]):
+                    if query.match(name):
+                        result.append((relative, name))
+            for relative in set(self._listed) - set(directories):
+                del self._listed[relative]
+        return result
+
+    def _listed_names(self, relative, directory):
+        try:
+            mtime = os.path.getmtime(directory)
+        except OSError:
+            return []
+        entry = self._listed.get(relative)
+        if entry is None or entry[0] != mtime:
+            try:
+                names = sorted(item.name for item in scandir(directory) if not item.name.startswith('.'))
+            except OSError:
+                return []
+            entry = (mtime, names)
+            self._listed[relative] = entry
+        return entry[1]
+
+    def _names(self, backend, relative, directory):
+        version = backend.version(directory)
+        if version is None:
+            return []
+        entry = self._dirs.get(relative)
+        if entry is None or entry[0] != version[0]:
+            entry = (version[0], sorted(backend.load(directory) or ()))
+            self._dirs[relative] = entry
+        return entry[1]
@@ -0,0 +1,67 @@
+"""
+streaming iter_json, buffered
+
+JSON encoding of results with lazy parts, generators are encoded as arrays item by item so the whole
+response is never held in memory.
+
+"""
+import json
+from types import GeneratorType
+
+
+def iter_json(value):
+    """ yields chunks of JSON of value, generators in value are encoded as arrays
+    :param value: result with values supported by json and generators
+    """
+    if not _is_lazy(value):
+        yield json.dumps(value)
+    elif isinstance(value, dict):
+        yield '{'
+        first = True
+        for key, item in value.items():
+            if not first:
+                yield ', '
+            first = False
+            yield json.dumps(key) + ': '
+            for chunk in iter_json(item):
+                yield chunk
+        yield '}'
+    else:
+        yield '['
+        first = True
+        for item in value:
+            if not first:
+                yield ', '
+            first = False
+            for chunk in iter_json(item):
+                yield chunk
+        yield ']'
+
+
+def _is_lazy(value):
+    """ returns True if value contains generator """
+    if isinstance(value, GeneratorType):
+        return True
+    if isinstance(value, dict):
+        return any(_is_lazy(item) for item in value.values())
+    if isinstance(value, (list, tuple)):
+        return any(_is_lazy(item) for item in value)
+    return False
+
+
+def buffered(chunks, size=65536):
+    """ yields chunks joined to blocks of at least given size, server writes each block at once
+    :param chunks: iterable of strings
+    :param size: min. size of block except the last one
+    """
+    block = []
+    length = 0
+    for chunk in chunks:
+        block.append(chunk)
+        length += len(chunk)
+        if length >= size:
+            yield ''.join(block)
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block)
@@ -0,0 +1,221 @@
+"""
+thumbnails ThumbnailStore, ThumbnailQueue
+
+"""
+from StringIO import StringIO
+from multiprocessing import Pool
+import errno
+import hashlib
+import os
+import re
+import threading
+import time
+
+from PIL import Image
+
+from connector.metadata import EXIF_ORIENTATION, orient, read_exif, read_pixels
+from connector.utils import atomic_write, state_dir
+
+
+def make_thumbnail(filename, target, max_width, max_height):
+    """ save thumbnail of image as jpeg, returns metadata read from pixels of thumbnail, None if image
+    cannot be read
+    :param filename: full path to image
+    :param target: full path to thumbnail
+    :param max_width: max width of thumbnail
+    :param max_height: max height of thumbnail
+    """
+    try:
+        im = Image.open(filename)
+    except IOError:
+        return None
+    return render_thumbnail(im, target, max_width, max_height)
+
+
+def render_thumbnail(im, target, max_width, max_height, orientation=None):
+    """ save thumbnail of opened image as jpeg turned by EXIF orientation, returns dictionary with
+    metadata read from pixels of thumbnail by read_pixels, None if image cannot be decoded
+    :param im: image opened by Image.open, only header may be read
+    :param target: full path to thumbnail
+    :param max_width: max width of thumbnail
+    :param max_height: max height of thumbnail
+    :param orientation: EXIF orientation of image, None reads it from image
+    """
+    if orientation is None:
+        orientation = read_exif(im).get(EXIF_ORIENTATION)
+    # image is turned after scaling, turned by 90 degrees it has swapped sides
+    size = (max_height, max_width) if orientation in (5, 6, 7, 8) else (max_width, max_height)
+    try:
+        # jpeg is decoded directly in 1/2, 1/4 or 1/8 of size not smaller than thumbnail
+        im.draft('RGB', size)
+        if im.mode not in ('RGB', 'L'):
+            im = im.convert('RGB')
+        im.thumbnail(size, Image.ANTIALIAS)
+    except IOError:
+        return None
+    im = orient(im, orientation)
+
+    string_file = StringIO()
+    im.save(string_file, 'JPEG', quality=90)
+    ThumbnailStore.write(target, string_file.getvalue())
+    return read_pixels(im)
+
+
+class ThumbnailStore(object):
+    """ thumbnails stored in files named by hash of path, mtime and size of image, thumbnails of moved images
+    are renamed by move()
+    """
+
+    STORE_DIRNAME = 'thumbs'
+    # changed when thumbnails are rendered differently, i.e. turned by EXIF orientation since version 2
+    VERSION = 2
+
+    def __init__(self, base_dir):
+        self._dir = state_dir(base_dir) + self.STORE_DIRNAME + '/'
+
+    @staticmethod
+    def key(path, filename, mtime, size, max_width, max_height):
+        """ returns key of thumbnail
+        :param path: relative path of folder of image with trailing slash, empty for base dir
+        :param filename: name of image
+        :param mtime: modification time of image
+        :param size: size of image in bytes
+        :param max_width: max width of thumbnail
+        :param max_height: max height of thumbnail
+        """
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        if isinstance(filename, unicode):
+            filename = filename.encode('utf-8')
+        return hashlib.sha1('%s%s|%r|%d|%dx%d|%d' % (path, filename, mtime, size, max_width, max_height,
+                                                      ThumbnailStore.VERSION)).hexdigest()
+
+    @staticmethod
+    def is_key(value):
+        """ returns True if value is valid key of thumbnail
+        :param value: tested value
+        """
+        return bool(value) and re.match('^[0-9a-f]{40}$', value) is not None
+
+    def filename(self, key):
+        """ returns full path to thumbnail
+        :param key: key of thumbnail
+        """
+        return self._dir + key[:2] + '/' + key + '.jpg'
+
+    def exists(self, key):
+        """ returns True if thumbnail is stored
+        :param key: key of thumbnail
+        """
+        return os.path.isfile(self.filename(key))
+
+    def delete(self, key):
+        """ delete stored thumbnail
+        :param key: key of thumbnail
+        """
+        try:
+            os.unlink(self.filename(key))
+        except OSError:
+            pass
+
+    def move(self, key, new_key):
+        """ rename stored thumbnail of moved image, missing thumbnail is rendered again when it is needed
+        :param key: key of thumbnail at original path of image
+        :param new_key: key of thumbnail at new path of image
+        """
+        if key == new_key:
+            return
+        target = self.filename(new_key)
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                return
+        try:
+            os.rename(self.filename(key), target)
+        except OSError:
+            pass
+
+    @staticmethod
+    def write(target, data):
+        """ write thumbnail, readers never see partially written file
+        :param target: full path to thumbnail
+        :param data: content of thumbnail
+        """
+        try:
+            os.makedirs(os.path.dirname(target))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        atomic_write(target, data)
+
+
+class ThumbnailQueue(object):
+    """ generate thumbnails in pool of background processes """
+
+    # returned instead of thumbnail which is not finished yet
+    PENDING = object()
+
+    _queues = {}
+    _queues_lock = threading.Lock()
+
+    def __init__(self, workers, queue_size, timeout):
+        """
+        :param workers: number of worker processes
+        :param queue_size: max. number of jobs waiting for pickup
+        :param timeout: seconds after which unfinished job is abandoned
+        """
+        self._pool = Pool(workers)
+        self._queue_size = queue_size
+        self._timeout = timeout
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, config):
+        """ returns queue shared by all configurations with the same queue settings
+        :param config: instance of Config
+        """
+        key = (config.thumb_workers, config.thumb_queue_size, config.thumb_timeout)
+        with cls._queues_lock:
+            if key not in cls._queues:
+                cls._queues[key] = cls(*key)
+            return cls._queues[key]
+
+    def thumbnail(self, filename, target, max_width, max_height):
+        """ returns metadata read from pixels if thumbnail was saved, None if it failed, PENDING if thumbnail
+        is queued or queue is full
+        :param filename: full path to image
+        :param target: full path to thumbnail
+        :param max_width: max width of thumbnail
+        :param max_height: max height of thumbnail
+        """
+        with self._lock:
+            job = self._jobs.get(target)
+            if job is None:
+                if len(self._jobs) >= self._queue_size:
+                    self._prune()
+                if len(self._jobs) >= self._queue_size:
+                    return self.PENDING
+                result = self._pool.apply_async(make_thumbnail, (filename, target, max_width, max_height))
+                self._jobs[target] = (result, time.time())
+                return self.PENDING
+
+            result, started = job
+            if result.ready():
+                del self._jobs[target]
+                try:
+                    return result.get()
+                except Exception:
+                    return None
+            if time.time() - started > self._timeout:
+                del self._jobs[target]
+                return None
+            return self.PENDING
+
+    def _prune(self):
+        """ drop finished or expired jobs nobody picked up """
+        expired = time.time() - self._timeout
+        for key, (result, started) in self._jobs.items():
+            if started < expired:
+                del self._jobs[key]
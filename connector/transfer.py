@@ -0,0 +1,124 @@
+"""
+transfer copy_file, copy_tree, is_internal, move_file, move_tree
+
+"""
+import errno
+import os
+import shutil
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from connector.backends import JsonFileBackend
+from connector.utils import STATE_DIRNAME
+
+# caches and state of connector are not copied, they belong to source folder, other hidden files
+# (i.e. .htaccess) are copied
+INTERNAL_NAMES = frozenset((JsonFileBackend.CACHE_FILENAME, JsonFileBackend.LOCK_FILENAME, STATE_DIRNAME))
+# temporary files of uploads and of atomic_write of caches, name is prefix + random part + '.tmp'
+UPLOAD_TMP_PREFIX = '.htupload.'
+INTERNAL_TMP_PREFIXES = (UPLOAD_TMP_PREFIX, JsonFileBackend.CACHE_FILENAME + '.')
+COPY_BUFSIZE = 1048576
+
+
+def copy_file(src, dst):
+    """ copy content and permissions of file, uses sendfile if it is available, content is not copied
+    through user space then
+    :param src: full path to source file
+    :param dst: full path to target file
+    """
+    with open(src, 'rb') as src_file:
+        with open(dst, 'wb') as dst_file:
+            if not _sendfile(src_file, dst_file):
+                shutil.copyfileobj(src_file, dst_file, COPY_BUFSIZE)
+    shutil.copymode(src, dst)
+
+
+def _sendfile(src_file, dst_file):
+    """ returns False if sendfile is not supported and nothing was copied """
+    sendfile = getattr(os, 'sendfile', None)
+    if sendfile is None:
+        return False
+    size = os.fstat(src_file.fileno()).st_size
+    offset = 0
+    while offset < size:
+        try:
+            sent = sendfile(dst_file.fileno(), src_file.fileno(), offset, size - offset)
+        except OSError as e:
+            if offset == 0 and e.errno in (errno.EINVAL, errno.ENOSYS, errno.ENOTSUP):
+                return False
+            raise
+        if sent == 0:
+            break
+        offset += sent
+    return True
+
+
+def copy_tree(src, dst, mode_dir):
+    """ copy folder recursively, returns number of copied files
+    :param src: full path to source folder
+    :param dst: full path to target folder, must not exist
+    :param mode_dir: permissions of created folders
+    """
+    os.mkdir(dst)
+    os.chmod(dst, mode_dir)
+    count = 0
+    for entry in scandir(src):
+        if is_internal(entry.name):
+            continue
+        target = os.path.join(dst, entry.name)
+        if entry.is_dir(follow_symlinks=False):
+            count += copy_tree(entry.path, target, mode_dir)
+        elif entry.is_symlink():
+            os.symlink(os.readlink(entry.path), target)
+        else:
+            copy_file(entry.path, target)
+            count += 1
+    return count
+
+
+def is_internal(name):
+    """ returns True if file or folder belongs to connector and is not copied with folder
+    :param name: name of file or folder
+    """
+    return name in INTERNAL_NAMES or (name.startswith(INTERNAL_TMP_PREFIXES) and name.endswith('.tmp'))
+
+
+def move_file(src, dst):
+    """ move file, single rename on the same filesystem, copy and delete across filesystems. Unlike
+    shutil.move, file is never moved into existing folder of the same name
+    :param src: full path to source file
+    :param dst: full path to target file
+    :raise OSError: if target is folder
+    """
+    if os.path.isdir(dst):
+        raise OSError(errno.EISDIR, os.strerror(errno.EISDIR), dst)
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copy_file(src, dst)
+    os.unlink(src)
+
+
+def move_tree(src, dst, mode_dir):
+    """ move file or folder, single rename on the same filesystem, copy and delete across filesystems
+    :param src: full path to source file or folder
+    :param dst: full path to target file or folder
+    :param mode_dir: permissions of folders created across filesystems
+    """
+    try:
+        os.rename(src, dst)
+        return
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    if os.path.isdir(src) and not os.path.islink(src):
+        copy_tree(src, dst, mode_dir)
+        shutil.rmtree(src)
+    else:
+        move_file(src, dst)
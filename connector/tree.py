@@ -0,0 +1,456 @@
+"""
+tree TreeIndex
+
+"""
+import copy
+import os
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from connector.metrics import timer
+from connector.utils import atomic_write, state_dir
+
+
+# items of node of tree: total size of files in folder and subfolders, their number, subfolders by name
+SIZE = 0
+FILES = 1
+CHILDREN = 2
+
+
+class TreeIndex(object):
+    """ persistent index of folders tree stored in base dir. Each folder keeps total size and number of
+    files in it and in its subfolders, changes add differences to all parent folders. Changes never modify
+    nodes in place, changed nodes are copied, so tree returned to one thread is not changed by another thread.
+    Changes of index are serialized between threads and processes, index saved by another process is reloaded
+    before each change
+    """
+
+    INDEX_FILENAME = 'treeindex'
+    LOCK_FILENAME = 'treeindex.lock'
+    VERSION = 2
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, config):
+        self._base_dir = config.base_dir.rstrip('/') + '/'
+        self._state_dir = state_dir(self._base_dir, create=True)
+        self._indexfile = self._state_dir + self.INDEX_FILENAME
+        self._ttl = config.tree_ttl
+        self._root = None
+        self._version = None
+        self._scanned = 0
+        self._lock = threading.RLock()
+        self._lock_file = None
+        if not self._load():
+            with self._locked():
+                self._refresh()
+
+    @classmethod
+    def shared(cls, config):
+        """ returns index of root shared by all connectors of process, index is reloaded if it was saved
+        by another process
+        :param config: instance of Config
+        """
+        key = (os.path.abspath(config.base_dir), config.tree_ttl)
+        with cls._shared_lock:
+            index = cls._shared.get(key)
+            if index is None:
+                cls._shared[key] = index = cls(config)
+                return index
+        index.reload_if_changed()
+        return index
+
+    def _load(self):
+        """ load index file, returns False if file is missing, expired or invalid """
+        stat = self._stat()
+        if stat is None or self._is_expired(stat):
+            return False
+        try:
+            with open(self._indexfile) as data_file:
+                data = json.load(data_file)
+        except (IOError, ValueError):
+            return False
+        if not isinstance(data, dict) or data.get('version') != self.VERSION:
+            return False
+        self._root = data['tree']
+        self._scanned = data.get('scanned', 0)
+        self._version = TreeIndex._stat_version(stat)
+        return True
+
+    def _stat(self):
+        try:
+            return os.stat(self._indexfile)
+        except OSError:
+            return None
+
+    def _is_expired(self, stat):
+        """ index expires only if config sets tree_ttl, otherwise it is kept until it is rebuilt by prewarm
+        or by watcher, scan of large root does not block requests
+        """
+        return self._ttl is not None and stat.st_mtime <= time.time() - self._ttl
+
+    def _is_current(self):
+        stat = self._stat()
+        return stat is not None and not self._is_expired(stat) and TreeIndex._stat_version(stat) == self._version
+
+    def _refresh(self):
+        """ load index saved by another process, rebuild index if file is missing, expired or invalid, caller
+        holds lock. Returns True if index was rebuilt from disk
+        """
+        if self._root is not None and self._is_current():
+            return False
+        if self._load():
+            return False
+        self._rebuild()
+        return True
+
+    def reload_if_changed(self):
+        """ load index again if index file was changed by another process or it expired,
+        costs one stat if nothing changed
+        """
+        if not self._is_current():
+            with self._locked():
+                self._refresh()
+
+    @contextmanager
+    def _locked(self):
+        """ exclusive reload, change and save of index between threads and processes, the same way as
+        CacheDir._locked. Nested calls of one thread take lockf only once, closing of second descriptor
+        of lock file would release lock of process
+        """
+        with self._lock:
+            if self._lock_file is not None:
+                yield
+                return
+            with open(self._state_dir + self.LOCK_FILENAME, 'a') as lock_file:
+                if fcntl is not None:
+                    fcntl.lockf(lock_file, fcntl.LOCK_EX)
+                self._lock_file = lock_file
+                try:
+                    yield
+                finally:
+                    self._lock_file = None
+
+    @contextmanager
+    def _changing(self):
+        """ lock index for change, index saved by another process meanwhile is reloaded first """
+        with self._locked():
+            self._refresh()
+            yield
+
+    def get_tree(self, path='', depth=None, lazy=False):
+        """ returns tree of folders as list with one node, None if path is not in index
+        :param path: relative path of returned node, empty for base dir
+        :param depth: max. number of nested levels, None for unlimited
+        :param lazy: True returns children of nodes as generators, nodes are formatted during encoding
+        """
+        with timer('tree_format'):
+            node = TreeIndex._node(self._root, path)
+            if node is None:
+                return None
+            parts = TreeIndex.split_path(path)
+            name = parts[-1] if parts else os.path.basename(os.path.normpath(self._base_dir))
+            return [TreeIndex._format_node(name, node, depth, lazy)]
+
+    @staticmethod
+    def _format_node(name, node, depth, lazy):
+        children = node[CHILDREN]
+        # children of indexed folder are known without reading disk
+        tmp = {'name': name, 'has_children': bool(children), 'size': node[SIZE], 'files': node[FILES]}
+        if children and (depth is None or depth > 0):
+            nodes = (TreeIndex._format_node(child, children[child], None if depth is None else depth - 1, lazy)
+                     for child in sorted(children))
+            tmp['children'] = nodes if lazy else list(nodes)
+        return tmp
+
+    def version(self):
+        """ returns value which changes with each save of index """
+        return TreeIndex._stat_version(os.stat(self._indexfile))
+
+    @staticmethod
+    def _stat_version(stat):
+        return stat.st_mtime, stat.st_size, stat.st_ino
+
+    def paths(self, path=''):
+        """ returns list of relative paths with trailing slash of folder and all its subfolders, empty path
+        for base dir, empty list if folder is not in index
+        :param path: relative path of folder, empty for base dir
+        """
+        node = TreeIndex._node(self._root, path)
+        if node is None:
+            return []
+        result = []
+        stack = [(''.join(part + '/' for part in TreeIndex.split_path(path)), node)]
+        while stack:
+            path, node = stack.pop()
+            result.append(path)
+            for name, child in node[CHILDREN].items():
+                stack.append((path + name + '/', child))
+        return result
+
+    def children_totals(self, path):
+        """ returns dictionary name -> (total size of files, number of files) of subfolders of folder
+        :param path: relative path of folder
+        """
+        node = TreeIndex._node(self._root, path)
+        if node is None:
+            return {}
+        return dict((name, (child[SIZE], child[FILES])) for name, child in node[CHILDREN].items())
+
+    def update_totals(self, path, size, files, since=None):
+        """ add changes of files in folder to totals of folder and all its parents
+        :param path: relative path of folder with changed files
+        :param size: change of total size of files in bytes
+        :param files: change of number of files
+        :param since: time before files were changed on disk, changes are not added if index was rebuilt
+            from disk later (by this call or by another process), the scan already counted them
+        """
+        if not size and not files:
+            return
+        with self._changing():
+            if since is not None and self._scanned >= since:
+                return
+            root, nodes = self._writable(path)
+            if nodes is None:
+                self._rebuild()
+                return
+            TreeIndex._add_totals(nodes, size, files)
+            self._commit(root)
+
+    def set_files_totals(self, path, size, files):
+        """ set total size and number of files directly in folder, difference is added to totals of folder
+        and all its parents. Folder which is not in index is skipped, its files are counted when it is added
+        :param path: relative path of folder
+        :param size: total size of files in folder in bytes, files in subfolders are not included
+        :param files: number of files in folder
+        """
+        with self._changing():
+            node = TreeIndex._node(self._root, path)
+            if node is None:
+                return
+            children = node[CHILDREN].values()
+            size -= node[SIZE] - sum(child[SIZE] for child in children)
+            files -= node[FILES] - sum(child[FILES] for child in children)
+            if not size and not files:
+                return
+            root, nodes = self._writable(path)
+            TreeIndex._add_totals(nodes, size, files)
+            self._commit(root)
+
+    def rebuild(self):
+        """ rebuild entire index from disk """
+        with self._locked():
+            self._rebuild()
+
+    def _rebuild(self):
+        scanned = time.time()
+        with timer('tree_scan'):
+            self._root = self._scan(self._base_dir)
+        self._scanned = scanned
+        self._save()
+
+    def add(self, path, name):
+        """ add folder and its subfolders to index
+        :param path: relative path of parent folder
+        :param name: name of added folder
+        """
+        with self._changing():
+            root, nodes = self._writable(path)
+            if nodes is None:
+                self._rebuild()
+                return
+            node = self._scan(self._full_path(path) + name + '/')
+            old = nodes[-1][CHILDREN].get(name, [0, 0])
+            nodes[-1][CHILDREN][name] = node
+            TreeIndex._add_totals(nodes, node[SIZE] - old[SIZE], node[FILES] - old[FILES])
+            self._commit(root)
+
+    def remove(self, path, name):
+        """ remove folder and its subfolders from index
+        :param path: relative path of parent folder
+        :param name: name of removed folder
+        """
+        self.remove_many(path, [name])
+
+    def remove_many(self, path, names):
+        """ remove folders and their subfolders from index
+        :param path: relative path of parent folder
+        :param names: names of removed folders
+        """
+        with self._changing():
+            root, nodes = self._writable(path)
+            if nodes is None:
+                self._rebuild()
+                return
+            for name in names:
+                node = nodes[-1][CHILDREN].pop(name, None)
+                if node is not None:
+                    TreeIndex._add_totals(nodes, -node[SIZE], -node[FILES])
+            self._commit(root)
+
+    def rename(self, path, old, new):
+        """ rename folder in index
+        :param path: relative path of parent folder
+        :param old: original name of folder
+        :param new: new name of folder
+        """
+        with self._changing():
+            root, nodes = self._writable(path)
+            if nodes is None or old not in nodes[-1][CHILDREN]:
+                self._rebuild()
+                return
+            children = nodes[-1][CHILDREN]
+            children[new] = children.pop(old)
+            self._commit(root)
+
+    def copy(self, path, name, new_path, new_name):
+        """ copy folder and its subfolders in index without reading disk
+        :param path: relative path of parent folder
+        :param name: name of copied folder
+        :param new_path: relative path of target parent folder
+        :param new_name: name of copy
+        """
+        self._attach(path, [(name, new_name)], new_path, False)
+
+    def copy_many(self, path, names, new_path):
+        """ copy folders and their subfolders in index with one write
+        :param path: relative path of parent folder
+        :param names: names of copied folders
+        :param new_path: relative path of target parent folder
+        """
+        self._attach(path, [(name, name) for name in names], new_path, False)
+
+    def move(self, path, name, new_path, new_name):
+        """ move folder and its subfolders in index without reading disk
+        :param path: relative path of parent folder
+        :param name: name of moved folder
+        :param new_path: relative path of target parent folder
+        :param new_name: new name of folder
+        """
+        self._attach(path, [(name, new_name)], new_path, True)
+
+    def move_many(self, path, names, new_path):
+        """ move folders and their subfolders in index with one write
+        :param path: relative path of parent folder
+        :param names: names of moved folders
+        :param new_path: relative path of target parent folder
+        """
+        self._attach(path, [(name, name) for name in names], new_path, True)
+
+    def _attach(self, path, names, new_path, is_move):
+        with self._changing():
+            copied = set()
+            root, nodes = self._writable(path, copied=copied)
+            root, new_nodes = self._writable(new_path, root, copied)
+            if nodes is None or new_nodes is None or any(name not in nodes[-1][CHILDREN] for name, _ in names):
+                self._rebuild()
+                return
+            for name, new_name in names:
+                # unchanged subtrees are shared by old and new root
+                if is_move:
+                    node = nodes[-1][CHILDREN].pop(name)
+                    TreeIndex._add_totals(nodes, -node[SIZE], -node[FILES])
+                else:
+                    node = copy.deepcopy(nodes[-1][CHILDREN][name])
+                old = new_nodes[-1][CHILDREN].get(new_name, [0, 0])
+                new_nodes[-1][CHILDREN][new_name] = node
+                TreeIndex._add_totals(new_nodes, node[SIZE] - old[SIZE], node[FILES] - old[FILES])
+            self._commit(root)
+
+    @staticmethod
+    def _node(root, path):
+        node = root
+        for part in TreeIndex.split_path(path):
+            if part not in node[CHILDREN]:
+                return None
+            node = node[CHILDREN][part]
+        return node
+
+    @staticmethod
+    def _add_totals(nodes, size, files):
+        for node in nodes:
+            node[SIZE] += size
+            node[FILES] += files
+
+    def _writable(self, path, root=None, copied=None):
+        """ returns tuple (copy of root, list of copied nodes from root to node of path or None), only nodes
+        on path are copied
+        :param path: relative path of changed node
+        :param root: root copied by previous call of the same change, None copies current root
+        :param copied: set of ids of nodes copied by previous calls of the same change
+        """
+        if copied is None:
+            copied = set()
+        if root is None:
+            root = TreeIndex._copy_node(self._root)
+            copied.add(id(root))
+        nodes = [root]
+        for part in TreeIndex.split_path(path):
+            children = nodes[-1][CHILDREN]
+            if part not in children:
+                return root, None
+            if id(children[part]) not in copied:
+                children[part] = TreeIndex._copy_node(children[part])
+                copied.add(id(children[part]))
+            nodes.append(children[part])
+        return root, nodes
+
+    @staticmethod
+    def _copy_node(node):
+        return [node[SIZE], node[FILES], dict(node[CHILDREN])]
+
+    def _commit(self, root):
+        self._root = root
+        self._save()
+
+    def _full_path(self, path):
+        parts = TreeIndex.split_path(path)
+        return self._base_dir + ''.join(part + '/' for part in parts)
+
+    @staticmethod
+    def split_path(path):
+        """ returns list of folder names in relative path
+        :param path: relative path
+        """
+        return [part for part in path.split('/') if part]
+
+    def _scan(self, directory):
+        node = [0, 0, {}]
+        try:
+            entries = scandir(directory)
+        except OSError:
+            return node
+        for entry in entries:
+            if entry.name.startswith('.'):
+                continue
+            try:
+                # is_dir() uses d_type from readdir, stat is called only for files and symlinks
+                if entry.is_dir():
+                    child = node[CHILDREN][entry.name] = self._scan(directory + entry.name + '/')
+                    node[SIZE] += child[SIZE]
+                    node[FILES] += child[FILES]
+                elif entry.is_file():
+                    node[SIZE] += entry.stat().st_size
+                    node[FILES] += 1
+            except OSError:
+                # deleted by another process during scan
+                continue
+        return node
+
+    def _save(self):
+        data = {'version': self.VERSION, 'tree': self._root, 'scanned': self._scanned}
+        atomic_write(self._indexfile, json.dumps(data, ensure_ascii=False))
+        self._version = self.version()
@@ -0,0 +1,181 @@
+"""
+uploads ChunkedUpload, write_upload
+
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from connector.transfer import UPLOAD_TMP_PREFIX, move_file
+from connector.utils import atomic_write, state_dir
+
+
+def write_upload(chunks, target, mode):
+    """ stream chunks into temporary file renamed to target, returns sha1 of content
+    :param chunks: iterable of strings
+    :param target: full path to file
+    :param mode: permissions of file
+    """
+    hasher = hashlib.sha1()
+    handle, tmp_name = tempfile.mkstemp(dir=os.path.dirname(target), prefix=UPLOAD_TMP_PREFIX, suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as tmp_file:
+            for chunk in chunks:
+                tmp_file.write(chunk)
+                hasher.update(chunk)
+        try:
+            os.chmod(tmp_name, mode)
+        except OSError:
+            pass
+        if os.name == 'nt' and os.path.isfile(target):
+            os.unlink(target)
+        os.rename(tmp_name, target)
+    except Exception:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+    return hasher.hexdigest()
+
+
+class ChunkedUpload(object):
+    """ upload of one file in chunks sent by more requests, interrupted upload can continue from
+    current offset. Parts are stored in folder of connector until upload is finished
+    """
+
+    DIRNAME = 'uploads'
+    MAX_AGE = 86400
+
+    # sha1 of parts appended by this process, other processes may append some chunks
+    _hashers = {}
+    _hashers_lock = threading.Lock()
+
+    def __init__(self, base_dir, upload_id):
+        self.id = upload_id
+        self._dir = state_dir(base_dir) + self.DIRNAME + '/'
+        self._part = self._dir + upload_id + '.part'
+        self._meta = self._dir + upload_id + '.json'
+
+    @classmethod
+    def create(cls, base_dir, path, name, size=None):
+        """ start new upload, returns instance of ChunkedUpload
+        :param base_dir: full path to root directory
+        :param path: relative path of target folder
+        :param name: name of target file
+        :param size: expected size of file, None if it is unknown
+        """
+        upload = cls(base_dir, uuid.uuid4().hex)
+        if not os.path.isdir(upload._dir):
+            os.makedirs(upload._dir)
+        cls._cleanup(upload._dir)
+        open(upload._part, 'wb').close()
+        atomic_write(upload._meta, json.dumps({'path': path, 'name': name, 'size': size}))
+        with cls._hashers_lock:
+            cls._hashers[upload.id] = (0, hashlib.sha1())
+        return upload
+
+    @staticmethod
+    def is_id(value):
+        """ returns True if value is valid id of upload
+        :param value: tested value
+        """
+        return bool(value) and re.match('^[0-9a-f]{32}$', value) is not None
+
+    @classmethod
+    def _cleanup(cls, directory):
+        """ delete abandoned uploads """
+        expired = time.time() - cls.MAX_AGE
+        for filename in os.listdir(directory):
+            try:
+                if os.path.getmtime(directory + filename) < expired:
+                    os.unlink(directory + filename)
+            except OSError:
+                pass
+
+    def exists(self):
+        """ returns True if upload was started and not finished """
+        return os.path.isfile(self._meta) and os.path.isfile(self._part)
+
+    def meta(self):
+        """ returns dictionary with target 'path', 'name' and expected 'size' """
+        with open(self._meta) as meta_file:
+            return json.load(meta_file)
+
+    def offset(self):
+        """ returns number of received bytes """
+        return os.path.getsize(self._part)
+
+    def append(self, offset, chunks):
+        """ append chunks, returns False if offset does not match number of received bytes
+        :param offset: position of chunks in file
+        :param chunks: iterable of strings
+        """
+        with open(self._part, 'ab') as part_file:
+            if fcntl is not None:
+                fcntl.lockf(part_file, fcntl.LOCK_EX)
+            part_file.seek(0, os.SEEK_END)
+            if part_file.tell() != offset:
+                return False
+
+            with self._hashers_lock:
+                entry = self._hashers.pop(self.id, None)
+            hasher = entry[1] if entry is not None and entry[0] == offset else None
+            for chunk in chunks:
+                part_file.write(chunk)
+                if hasher is not None:
+                    hasher.update(chunk)
+            if hasher is not None:
+                with self._hashers_lock:
+                    self._hashers[self.id] = (part_file.tell(), hasher)
+        return True
+
+    def digest(self):
+        """ returns sha1 of received content, content is read again only if some chunks were received
+        by another process
+        """
+        with self._hashers_lock:
+            entry = self._hashers.get(self.id)
+        if entry is not None and entry[0] == self.offset():
+            return entry[1].hexdigest()
+
+        hasher = hashlib.sha1()
+        with open(self._part, 'rb') as part_file:
+            for chunk in iter(lambda: part_file.read(1048576), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def finish(self, target, mode):
+        """ move received file to target
+        :param target: full path to file
+        :param mode: permissions of file
+        :raise OSError: if target is folder
+        """
+        try:
+            os.chmod(self._part, mode)
+        except OSError:
+            pass
+        if os.name == 'nt' and os.path.isfile(target):
+            os.unlink(target)
+        move_file(self._part, target)
+        self.abort()
+
+    def abort(self):
+        """ delete received content """
+        with self._hashers_lock:
+            self._hashers.pop(self.id, None)
+        for filename in (self._part, self._meta):
+            try:
+                os.unlink(filename)
+            except OSError:
+                pass
@@ -0,0 +1,67 @@
+"""
+utils atomic_write, relative_path, state_dir
+
+"""
+import errno
+import os
+import tempfile
+
+# hidden folder in base dir with index, thumbnails and other files of connector
+STATE_DIRNAME = '.htconnector'
+
+
+def atomic_write(filename, data, mode=None):
+    """ write file through temporary file renamed over target, readers never see partial content
+    :param filename: full path to file
+    :param data: content of file
+    :param mode: permissions of file, None keeps permissions of temporary file
+    """
+    if isinstance(data, unicode):
+        data = data.encode('utf-8')
+    handle, tmp_name = tempfile.mkstemp(dir=os.path.dirname(filename),
+                                        prefix=os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as tmp_file:
+            tmp_file.write(data)
+        if mode is not None:
+            os.chmod(tmp_name, mode)
+        try:
+            os.rename(tmp_name, filename)
+        except OSError:
+            # rename does not replace existing file on Windows
+            if os.name != 'nt':
+                raise
+            os.unlink(filename)
+            os.rename(tmp_name, filename)
+    except Exception:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+        raise
+
+
+def relative_path(base_dir, directory):
+    """ returns path of directory relative to base dir with trailing slash, empty for base dir itself
+    :param base_dir: full path to root directory
+    :param directory: full path to directory inside base dir
+    """
+    base_dir = os.path.abspath(base_dir)
+    directory = os.path.abspath(directory)
+    return '' if directory == base_dir else directory[len(base_dir) + 1:] + '/'
+
+
+def state_dir(base_dir, create=False):
+    """ returns full path with trailing slash to folder with files of connector in base dir. Files are written
+    only inside it, so they do not change mtime of base dir and its cache stays fresh
+    :param base_dir: full path to root directory
+    :param create: True creates folder if it does not exist
+    """
+    directory = base_dir.rstrip('/') + '/' + STATE_DIRNAME + '/'
+    if create:
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+    return directory
@@ -12,12 +12,38 @@ Returns JSON with properties:
  tree - tree of folders. Returned if action change folders
  files - list of folders and files in given path. Returned if action change files in current path
 
+ Responses of config with GSTBROWSER_STREAM_RESPONSES are sent in blocks while "files" and "tree"
+ are encoded, entry by entry, instead of one JSON string
+
+ Responses of actions "files" and "tree" requested by GET have header ETag, request with
+ If-None-Match of unchanged result gets response 304 without content
+
  action "tree"
     returns property "tree" with all directories as array of objects. Each object represents one folder
-    and contains array "children" with nested folders and files
+    and contains array "children" with nested folders and files and flag "has_children",
+    "size" with total size of files in folder and its subfolders and "files" with their number
+    optional GET/POST['depth'] switches to lazy mode: returns only subtree of folder in path with
+    given number of levels of nested folders, i.e. for expanding one node
 
  action "files"
-    returns property "files" with folders and files in current path
+    returns property "files" with folders and files in current path, folders first,
+    and property "total" with number of all folders and files
+    optional GET/POST['sort'] - name (default), date or size
+    optional GET/POST['order'] - asc (default) or desc
+    optional GET/POST['offset'] and GET/POST['limit'] return only one page of sorted files
+    thumbnails of images are generated in background, file with "thumbnail_pending" gets thumbnail
+    in some of next requests
+    folders have "size" and "files" with total size and number of files in folder and its subfolders
+    each file has property "mime" with type detected by content, i.e. for filtering of files by client
+    images have property "meta" with EXIF "orientation" and "taken" date, "blurhash" and average "color"
+    of thumbnail, values read from pixels are added when thumbnail is finished
+
+ action "search" search files and folders by name in all folders
+    require GET/POST['q'] with searched text
+    optional GET/POST['mode'] - substring (default), glob (i.e. *.jpg) or ext (i.e. jpg,png)
+    optional GET/POST['offset'] and GET/POST['limit'] return only one page of found files
+    returns property "files" where each file has property "path" with relative path of its folder,
+    and property "total" with number of all found files
 
  action "mkdir" create new folder
     require POST['dir'] with name of new folder
@@ -35,30 +61,120 @@ Returns JSON with properties:
     if renamed item is folder, returns property "tree"
 
 action "upload" upload files
-    require standard FILES['file']
-    returns property "files"
+    require standard FILES['file'], repeated for more files
+    returns property "files" and property "hash" with sha1 of content,
+    for more files returns property "items" with "name", "status", "hash" and optional "err" of each file
+
+ action "upload_init" start chunked upload of one file to current path
+    require POST['name'] with name of file
+    optional POST['size'] with size of file, finalize fails until all bytes are received
+    returns property "upload" with id of upload
+
+ action "upload_chunk" append chunk to chunked upload
+    require POST['upload'] with id of upload
+    require POST['offset'] with position of chunk, must be equal to number of already received bytes
+    require FILES['chunk'] with content of chunk
+    returns property "offset" with number of received bytes, also if offset does not match
+
+ action "upload_status" returns property "offset" with number of received bytes, interrupted upload
+    continues from this offset
+    require GET/POST['upload'] with id of upload
+
+ action "upload_finalize" move uploaded file to its folder
+    require POST['upload'] with id of upload
+    returns property "files" and property "hash" with sha1 of content
 
- action "copy" copy file in current path to another folder
-    require POST['old'] with name of file
+ action "copy" copy file or folder with all its content in current path to another folder
+    require POST['old'] with name of file or folder
     require POST['new'] with target folder, or target folder/name
+    if copied item is folder, returns property "tree"
 
- action "move" moves file in current path to another folder
-    require POST['old'] with name of file
+ action "move" moves file or folder in current path to another folder
+    require POST['old'] with name of file or folder
     require POST['new'] with target folder, or target folder/name
     returns property "files"
+    if moved item is folder, returns property "tree"
+
+ action "stats" returns property "listings" with counters of in-process cache of directories
+    and property "pid", counters are collected separately by each process
+
+ action "batch_delete" delete files and folders in current path
+    require POST['names'] repeated for each name of file or folder
+    returns property "items" with "name", "status" and optional "err" of each name and property "files",
+    if some folder was deleted, returns property "tree"
+
+ action "batch_copy" copy files and folders in current path to another folder
+    require POST['names'] repeated for each name of file or folder
+    require POST['new'] with target folder
+    returns property "items", if some folder was copied, returns property "tree"
+
+ action "batch_move" move files and folders in current path to another folder
+    require POST['names'] repeated for each name of file or folder
+    require POST['new'] with target folder
+    returns property "items" and property "files", if some folder was moved, returns property "tree"
+
+ action "metrics" returns timers and counters of process in Prometheus text format, not JSON,
+    they are collected if GSTBROWSER_METRICS is enabled
+
+ action "thumb" returns thumbnail of image as image/jpeg, not JSON
+    require GET['key'] with key of thumbnail. Property "thumbnail" in "files" contains complete url
+    supports conditional requests with If-None-Match and If-Modified-Since
 
 """
 
 import json
+import os
+import time
 
-from django.http import HttpResponse, HttpResponseForbidden
+from django.http import HttpResponse, HttpResponseForbidden, HttpResponseNotFound, HttpResponseNotModified, \
+    StreamingHttpResponse
 from django.conf import settings
+from django.utils.http import http_date, parse_http_date_safe
 
-from connector.models import Config, Connector
+from connector.listings import ListingCache
+from connector.metrics import Metrics
+from connector.models import Connector
+from connector.registry import ConfigRegistry
+from connector.streaming import buffered, iter_json
+
+ListingCache.shared().max_size = getattr(settings, 'GSTBROWSER_LISTING_CACHE_SIZE', 256)
+Metrics.shared().enabled = getattr(settings, 'GSTBROWSER_METRICS', False)
+Metrics.shared().server_timing = getattr(settings, 'GSTBROWSER_SERVER_TIMING', False)
+
+# configs are resolved once, settings changed later are not used
+CONFIGS = ConfigRegistry(settings)
+
+# actions measured by metrics, other values of parameter action are measured together
+ACTIONS = ('tree', 'files', 'search', 'mkdir', 'upload', 'upload_init', 'upload_chunk', 'upload_status',
+           'upload_finalize', 'rename', 'delete', 'copy', 'move', 'batch_delete', 'batch_copy', 'batch_move',
+           'stats', 'metrics', 'thumb')
 
 
 def index(request):
-    """ entry point of connector
+    """ entry point of connector, measures time of action if metrics are enabled
+    :param request: HTTP request
+    """
+    metrics = Metrics.shared()
+    if not metrics.is_active():
+        return _index(request)
+
+    start = time.time()
+    metrics.start_request()
+    try:
+        response = _index(request)
+    finally:
+        timings = metrics.end_request()
+        action = _get_param(request, 'action')
+        metrics.observe('action', action if action in ACTIONS else 'unknown', time.time() - start)
+    if metrics.server_timing:
+        timings['total'] = time.time() - start
+        response['Server-Timing'] = ', '.join('%s;dur=%.1f' % (name, seconds * 1000)
+                                              for name, seconds in sorted(timings.items()))
+    return response
+
+
+def _index(request):
+    """ handle action of request
     :param request: HTTP request
     """
 
@@ -66,50 +182,87 @@ def index(request):
     # if request.session.get('some_variable', False) != 'some_value':
     #     return HttpResponseForbidden()
 
-    config = 'default'
-    if 'config' in request.GET:
-        config = request.GET['config']
-    else:
-        if 'config' in request.POST:
-            config = request.POST['config']
+    config = _get_param(request, 'config', 'default')
+    action = _get_param(request, 'action')
+    current_path = _get_param(request, 'path', '')
 
-    action = None
-    if 'action' in request.GET:
-        action = request.GET['action']
-    else:
-        if 'action' in request.POST:
-            action = request.POST['action']
+    gstbrowser_config = CONFIGS.get(config)
+    connector = CONFIGS.connector(config, request.path)
+
+    if action == 'metrics':
+        return HttpResponse(Metrics.shared().prometheus(), content_type='text/plain; version=0.0.4')
+
+    if action == 'thumb':
+        return _thumbnail_response(request, connector.get_thumbnail(_get_param(request, 'key', '')))
 
-    current_path = ''
-    if 'path' in request.GET:
-        current_path = request.GET['path']
+    try:
+        offset = _get_int_param(request, 'offset')
+        limit = _get_int_param(request, 'limit')
+        depth = _get_int_param(request, 'depth')
+        size = _get_int_param(request, 'size')
+    except ValueError:
+        action = 'invalid'
+
+    # names of files and target folders must not leave root by parent references
+    names = [value for key in ('old', 'new', 'name', 'dir', 'names') for value in request.POST.getlist(key)]
+    if not connector.is_inside(current_path, *(names + [os.path.join(current_path, name) for name in names])):
+        action = 'invalid'
+
+    if action in ('files', 'tree') and request.method in ('GET', 'HEAD'):
+        if action == 'files':
+            etag = connector.get_files_etag(current_path, offset or 0, limit, _get_param(request, 'sort', 'name'),
+                                            _get_param(request, 'order', 'asc'))
+        elif depth is None:
+            etag = connector.get_tree_etag()
+        else:
+            etag = connector.get_tree_etag(current_path, depth)
     else:
-        if 'path' in request.POST:
-            current_path = request.POST['path']
-
-    gstbrowser_config = Config(settings.GSTBROWSER_ROOT_DIR['default'])
-    if config in settings.GSTBROWSER_ROOT_DIR:
-        gstbrowser_config.base_dir = settings.GSTBROWSER_ROOT_DIR[config]
-    if config in settings.GSTBROWSER_MODE_DIR:
-        gstbrowser_config.mode_dir = settings.GSTBROWSER_MODE_DIR[config]
-    if config in settings.GSTBROWSER_MODE_FILE:
-        gstbrowser_config.mode_dir = settings.GSTBROWSER_MODE_FILE[config]
-    if config in settings.GSTBROWSER_THUMB_MAX_WIDTH:
-        gstbrowser_config.thumb_max_width = settings.GSTBROWSER_THUMB_MAX_WIDTH[config]
-    if config in settings.GSTBROWSER_THUMB_MAX_HEIGHT:
-        gstbrowser_config.thumb_max_height = settings.GSTBROWSER_THUMB_MAX_HEIGHT[config]
-
-    connector = Connector(gstbrowser_config)
-
-    if action == 'tree':
-        result = connector.get_folders_tree()
+        etag = None
+    if etag is not None and _etag_matches(request, etag):
+        return _conditional_headers(HttpResponseNotModified(), etag, gstbrowser_config)
+
+    if action == 'invalid':
+        result = {
+            'status': 'ERR',
+            'err': Connector.ERR_INVALID_PARAMETER
+        }
+    elif action == 'stats':
+        result = {
+            'status': 'OK',
+            'pid': os.getpid(),
+            'listings': ListingCache.shared().stats()
+        }
+    elif action == 'tree':
+        if depth is None:
+            result = connector.get_folders_tree()
+        else:
+            result = connector.get_folders_tree(current_path, depth)
     elif action == 'files':
-        result = connector.get_files(current_path)
+        result = connector.get_files(current_path, offset or 0, limit, _get_param(request, 'sort', 'name'),
+                                     _get_param(request, 'order', 'asc'))
+    elif action == 'search':
+        result = connector.search(_get_param(request, 'q', ''), _get_param(request, 'mode', 'substring'),
+                                  offset or 0, limit)
     elif action == 'mkdir':
         new_dir = request.POST['dir'] if request.POST['dir'] else ''
         result = connector.mk_dir(current_path, new_dir)
     elif action == 'upload':
-        result = connector.upload(current_path, request.FILES['file'])
+        uploaded_files = request.FILES.getlist('file')
+        if len(uploaded_files) == 1:
+            result = connector.upload(current_path, uploaded_files[0])
+        else:
+            result = connector.upload_many(current_path, uploaded_files)
+    elif action == 'upload_init':
+        result = connector.upload_init(current_path, request.POST.get('name', ''), size)
+    elif action == 'upload_chunk':
+        if 'chunk' in request.FILES:
+            result = connector.upload_chunk(request.POST.get('upload', ''), offset or 0, request.FILES['chunk'])
+        else:
+            result = Connector._output(Connector.ERR_INVALID_PARAMETER)
+    elif action == 'upload_status':
+        result = connector.upload_status(_get_param(request, 'upload', ''))
+    elif action == 'upload_finalize':
+        result = connector.upload_finalize(request.POST.get('upload', ''))
     elif action == 'rename':
         old = request.POST['old'] if request.POST['old'] else ''
         new = request.POST['new'] if request.POST['new'] else ''
@@ -125,10 +278,104 @@ def index(request):
         old = request.POST['old'] if request.POST['old'] else ''
         new = request.POST['new'] if request.POST['new'] else ''
         result = connector.move(current_path, old, new)
+    elif action == 'batch_delete':
+        result = connector.delete_many(current_path, request.POST.getlist('names'))
+    elif action == 'batch_copy':
+        result = connector.copy_many(current_path, request.POST.getlist('names'), request.POST.get('new', ''))
+    elif action == 'batch_move':
+        result = connector.move_many(current_path, request.POST.getlist('names'), request.POST.get('new', ''))
     else:
         result = {
             'status': 'ERR',
             'err': Connector.ERR_MISSING_ACTION
         }
 
-    return HttpResponse(json.dumps(result), content_type='application/json; charset=utf-8')
+    if gstbrowser_config.stream_responses:
+        response = StreamingHttpResponse(buffered(iter_json(result)), content_type='application/json; charset=utf-8')
+    else:
+        response = HttpResponse(json.dumps(result), content_type='application/json; charset=utf-8')
+    if etag is not None and result['status'] == 'OK':
+        _conditional_headers(response, etag, gstbrowser_config)
+    return response
+
+
+def get_config(config):
+    """ returns frozen Config of named config from settings, missing values are taken from default config
+    :param config: name of config
+    """
+    return CONFIGS.get(config)
+
+
+def _get_param(request, name, default=None):
+    """ returns GET or POST variable
+    :param request: HTTP request
+    :param name: name of variable
+    :param default: value returned if variable is missing
+    """
+    if name in request.GET:
+        return request.GET[name]
+    if name in request.POST:
+        return request.POST[name]
+    return default
+
+
+def _etag_matches(request, etag):
+    """ returns True if request has If-None-Match with given entity tag
+    :param request: HTTP request
+    :param etag: quoted entity tag
+    """
+    tags = [tag.strip() for tag in request.META.get('HTTP_IF_NONE_MATCH', '').split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+
+def _conditional_headers(response, etag, config):
+    """ returns response with entity tag and cache policy of config
+    :param response: HTTP response
+    :param etag: quoted entity tag
+    :param config: instance of Config
+    """
+    response['ETag'] = etag
+    if config.cache_control:
+        response['Cache-Control'] = config.cache_control
+    return response
+
+
+def _thumbnail_response(request, filename):
+    """ returns stored thumbnail, thumbnails never change so they can be cached by browser
+    :param request: HTTP request
+    :param filename: full path to thumbnail, None if thumbnail does not exist
+    """
+    if filename is None:
+        return HttpResponseNotFound()
+
+    etag = '"' + os.path.splitext(os.path.basename(filename))[0] + '"'
+    mtime = int(os.path.getmtime(filename))
+    if 'HTTP_IF_NONE_MATCH' in request.META:
+        not_modified = _etag_matches(request, etag)
+    else:
+        since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        not_modified = since is not None and since >= mtime
+
+    if not_modified:
+        response = HttpResponseNotModified()
+    else:
+        with open(filename, 'rb') as thumbnail:
+            response = HttpResponse(thumbnail.read(), content_type='image/jpeg')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(mtime)
+    response['Cache-Control'] = 'private, max-age=31536000'
+    return response
+
+
+def _get_int_param(request, name):
+    """ returns GET or POST variable as non negative integer, None if variable is missing or empty
+    :param request: HTTP request
+    :param name: name of variable
+    :raise ValueError: if variable is not a number
+    """
+    value = _get_param(request, name, '')
+    if value == '':
+        return None
+    if not value.isdigit():
+        raise ValueError(name)
+    return int(value)
@@ -0,0 +1,208 @@
+"""
+watcher Watcher
+
+Keeps caches of directories and tree of folders fresh by inotify events, files changed by other
+programs are updated one by one instead of rebuilding whole directory. Requires pyinotify.
+
+"""
+import logging
+import os
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from connector.backends import get_backend
+from connector.models import CacheDir
+from connector.tree import TreeIndex
+
+logger = logging.getLogger(__name__)
+
+
+class Watcher(object):
+    """ watch roots of configs and update their caches, events are collected until no event comes for
+    delay seconds, so bulk copies are applied with one update of each directory
+    """
+
+    def __init__(self, configs, delay=1.0, max_delay=10.0):
+        """
+        :param configs: list of Config, each root is watched once
+        :param delay: seconds without events after which collected changes are applied
+        :param max_delay: max. seconds for which changes are collected during continuous events
+        """
+        if pyinotify is None:
+            raise RuntimeError('pyinotify is required for watching of directories')
+        self._configs = {}
+        for config in configs:
+            if not os.path.isdir(config.base_dir):
+                logger.warning('root %s does not exist, it is not watched', config.base_dir)
+                continue
+            self._configs.setdefault(os.path.abspath(config.base_dir), config)
+        self._delay = delay
+        self._max_delay = max_delay
+        self._files = {}
+        self._folders = {}
+        self._overflow = False
+        self._first_event = None
+        self._last_event = None
+        self._manager = pyinotify.WatchManager()
+        mask = pyinotify.IN_CREATE | pyinotify.IN_DELETE | pyinotify.IN_CLOSE_WRITE | pyinotify.IN_ATTRIB \
+            | pyinotify.IN_MOVED_FROM | pyinotify.IN_MOVED_TO
+        for root in self._configs:
+            self._manager.add_watch(root, mask, rec=True, auto_add=True, exclude_filter=self._is_excluded)
+
+    def run(self):
+        """ process events until interrupted """
+        notifier = pyinotify.Notifier(self._manager, self._event)
+        try:
+            while True:
+                if notifier.check_events(int(self._delay * 1000)):
+                    notifier.read_events()
+                    notifier.process_events()
+                if self._is_ready():
+                    self.flush()
+        finally:
+            notifier.stop()
+
+    def _is_ready(self):
+        if self._first_event is None:
+            return False
+        now = time.time()
+        return now - self._last_event >= self._delay or now - self._first_event >= self._max_delay
+
+    def _root(self, path):
+        """ returns root containing path, None if path is not watched """
+        for root in self._configs:
+            if path == root or path.startswith(root + '/'):
+                return root
+        return None
+
+    def _is_excluded(self, path):
+        """ hidden folders contain caches and thumbnails of connector, their changes are not watched """
+        root = self._root(path)
+        relative = path[len(root):] if root else path
+        return any(part.startswith('.') for part in relative.split('/'))
+
+    def _event(self, event):
+        if event.mask & pyinotify.IN_Q_OVERFLOW:
+            self._overflow = True
+        elif not event.name or event.name.startswith('.') or self._is_excluded(event.path):
+            return
+        else:
+            directory = event.path.rstrip('/') + '/'
+            self._files.setdefault(directory, set()).add(event.name)
+            if event.dir or event.mask & (pyinotify.IN_DELETE | pyinotify.IN_MOVED_FROM):
+                # deleted item is not known to be folder if it was moved
+                self._folders.setdefault(directory, set()).add(event.name)
+        now = time.time()
+        if self._first_event is None:
+            self._first_event = now
+        self._last_event = now
+
+    def flush(self):
+        """ apply collected changes to caches and trees """
+        files, self._files = self._files, {}
+        folders, self._folders = self._folders, {}
+        overflow, self._overflow = self._overflow, False
+        since = self._first_event
+        self._first_event = self._last_event = None
+
+        trees = {}
+        for directory, names in files.items():
+            root = self._root(os.path.abspath(directory))
+            if root is None:
+                continue
+            config = self._configs[root]
+            try:
+                delta = self._update_directory(directory, names, config)
+            except (IOError, OSError) as e:
+                logger.warning('cache of %s was not updated: %s', directory, e)
+                delta = 0, 0
+            if overflow:
+                continue
+            if (delta != (0, 0) or directory in folders) and root not in trees:
+                trees[root] = TreeIndex(config)
+            path = directory[len(root) + 1:]
+            if delta is None:
+                # change of directory without cache is found by comparing its files with tree
+                totals = Watcher._files_totals(directory)
+                if totals is not None:
+                    trees[root].set_files_totals(path, totals[0], totals[1])
+            elif delta != (0, 0):
+                trees[root].update_totals(path, delta[0], delta[1], since)
+            if directory in folders:
+                self._update_tree(trees[root], root, directory, folders[directory])
+
+        if overflow:
+            # lost events cannot be replayed, changed directories are found by their mtime
+            logger.warning('inotify queue overflow, trees are rebuilt')
+            for config in self._configs.values():
+                TreeIndex(config).rebuild()
+
+    @staticmethod
+    def _update_directory(directory, names, config):
+        """ update changed items in cache, returns tuple (change of size, change of number) of files
+        compared with cached files, None if directory is not cached and change is not known
+        """
+        if not os.path.isdir(directory):
+            # removed folder is removed from tree by event of its parent
+            return 0, 0
+        backend = get_backend(config)
+        if backend.version(directory) is None:
+            # directory which was not cached yet is scanned on first request
+            return None
+        # saved items are read before CacheDir, it refreshes cache of changed directory
+        saved = backend.load(directory) or {}
+        cache = CacheDir(directory, config)
+        size = count = 0
+        for name in names:
+            old = saved.get(name)
+            if old is not None and old.type == 'file':
+                size -= old.size
+                count -= 1
+            if os.path.isfile(directory + name):
+                size += os.path.getsize(directory + name)
+                count += 1
+        existing = [name for name in names if os.path.exists(directory + name)]
+        deleted = [name for name in names if name not in existing]
+        if existing:
+            cache.update_items(existing)
+        if deleted:
+            cache.delete_items(deleted)
+        return size, count
+
+    @staticmethod
+    def _files_totals(directory):
+        """ returns tuple (total size, number) of files directly in directory, None if it was removed """
+        try:
+            entries = scandir(directory)
+        except OSError:
+            return None
+        size = count = 0
+        for entry in entries:
+            try:
+                if not entry.name.startswith('.') and entry.is_file():
+                    size += entry.stat().st_size
+                    count += 1
+            except OSError:
+                continue
+        return size, count
+
+    @staticmethod
+    def _update_tree(tree, root, directory, names):
+        path = directory[len(root) + 1:]
+        removed = []
+        for name in sorted(names):
+            if os.path.isdir(directory + name):
+                tree.add(path, name)
+            else:
+                removed.append(name)
+        if removed:
+            tree.remove_many(path, removed)
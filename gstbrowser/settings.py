@@ -37,6 +37,7 @@ INSTALLED_APPS = (
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'corsheaders',
+    'connector',
 )
 
 MIDDLEWARE_CLASSES = (
@@ -91,6 +92,31 @@ GSTBROWSER_MODE_DIR = dict(default=0755)
 GSTBROWSER_MODE_FILE = dict(default=0644)
 GSTBROWSER_THUMB_MAX_WIDTH = dict(default=90)
 GSTBROWSER_THUMB_MAX_HEIGHT = dict(default=90)
+# number of background processes generating thumbnails, 0 generates thumbnails in request
+GSTBROWSER_THUMB_WORKERS = dict(default=2)
+# max. number of queued thumbnails, seconds after which unfinished thumbnail is abandoned
+GSTBROWSER_THUMB_QUEUE_SIZE = dict(default=1000)
+GSTBROWSER_THUMB_TIMEOUT = dict(default=60)
+# seconds after which cached content of directory is checked for changed files
+GSTBROWSER_CACHE_TTL = dict(default=7200)
+# seconds after which index of folders is scanned again in request, None keeps index until prewarm or watcher
+# rebuilds it
+GSTBROWSER_TREE_TTL = dict(default=None)
+# storage of cached directories: 'json' - file .htdircache in each directory,
+# 'sqlite' - one database in folder .htconnector in root directory
+GSTBROWSER_CACHE_BACKEND = dict(default='json')
+# max. size of file in bytes announced by chunked upload, None for unlimited
+GSTBROWSER_MAX_UPLOAD_SIZE = dict(default=None)
+# send large listings and trees in blocks while they are encoded, memory does not grow with folder size
+GSTBROWSER_STREAM_RESPONSES = dict(default=False)
+# Cache-Control of files and tree, they are revalidated by ETag, empty for no header
+GSTBROWSER_CACHE_CONTROL = dict(default='private, no-cache')
+# max. number of directories kept parsed in memory of each process, shared by all configs
+GSTBROWSER_LISTING_CACHE_SIZE = 256
+# collect timers and counters of each process, available in Prometheus format by action "metrics"
+GSTBROWSER_METRICS = False
+# add header Server-Timing with durations of parts of request
+GSTBROWSER_SERVER_TIMING = False
 
 # override default configuration with named config
 GSTBROWSER_ROOT_DIR['test1'] = 'd:/temp/'
@@ -3,7 +3,7 @@ from distutils.core import setup
 setup(
     name='filebrowser-connector-python',
     version='0.01',
-    packages=['connector', 'gstbrowser'],
+    packages=['connector', 'connector.management', 'connector.management.commands', 'gstbrowser'],
     url='https://github.com/zdenekgebauer/gstbrowser-connector-python',
     license='WTFPL',
     author='Zdenek Gebauer',
@@ -14,6 +14,8 @@ setup(
     packages=[
         'gstbrowser',
         'connector',
+        'connector.management',
+        'connector.management.commands',
     ],
     classifiers=[
         'Development Status :: 3 - Alpha',